@@ -1,9 +1,13 @@
 from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
-from database import store_conversation, get_conversations
+from dotenv import load_dotenv
+
+# The action server is its own entry point, so it loads .env before database.py reads it
+load_dotenv()
+
+from database import store_conversation, iter_recent_messages
 from datetime import datetime, timedelta
-from collections import defaultdict
 
 class StoreConversationAction(Action):
     def name(self) -> Text:
@@ -29,59 +33,57 @@ class StoreConversationAction(Action):
         
         return []
 
-def get_recent_conversations(sender_id: str = None, days: int = 7):
-    """Get recent conversations grouped by daily sessions"""
-    conversations = get_conversations(sender_id)
-    
-    # Group conversations by date
-    daily_sessions = defaultdict(list)
-    for conv in conversations:
-        conv_date = conv['timestamp'].date()
-        daily_sessions[conv_date].append(conv)
-    
-    # Sort dates in descending order
-    sorted_dates = sorted(daily_sessions.keys(), reverse=True)
-    
-    # Format the data for the frontend
-    formatted_sessions = []
-    for date in sorted_dates:
-        sessions = daily_sessions[date]
-        # Group conversations by session (based on time gaps)
-        current_session = []
-        sessions_by_time = []
-        
-        for i, conv in enumerate(sessions):
-            if i > 0:
-                time_diff = conv['timestamp'] - sessions[i-1]['timestamp']
-                if time_diff > timedelta(minutes=30):  # New session if gap > 30 minutes
-                    if current_session:
-                        sessions_by_time.append(current_session)
-                    current_session = []
-            current_session.append(conv)
-        
-        if current_session:
-            sessions_by_time.append(current_session)
-        
-        # Format each session
-        for session in sessions_by_time:
-            first_message = session[0]
-            last_message = session[-1]
-            
-            formatted_sessions.append({
-                'id': str(first_message['_id']),
-                'title': first_message['intent'] or 'Conversation',
-                'lastMessage': last_message['message'],
-                'timestamp': format_timestamp(last_message['timestamp']),
-                'unreadCount': 0,  # You can implement unread tracking if needed
-                'date': date.strftime('%Y-%m-%d'),
-                'messages': session
-            })
-    
-    return formatted_sessions
+# A new session starts on a new day or after this long without messages
+SESSION_GAP = timedelta(minutes=30)
+TITLE_LENGTH = 40
+
+def get_recent_conversations(user_id: str = None, days: int = 7, limit: int = 20):
+    """Get a user's recent chat sessions, newest first
+
+    Messages are streamed newest first from MongoDB and grouped in a single pass, so
+    only the `limit` sessions returned are ever held in memory and reading stops as
+    soon as they are complete. Sessions are summaries; they carry no message list.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    sessions = []
+    current = None
+    for message in iter_recent_messages(user_id, since):
+        timestamp = message['timestamp']
+        if (current is None or timestamp.date() != current['started_at'].date()
+                or current['started_at'] - timestamp > SESSION_GAP):
+            if len(sessions) == limit:
+                break
+            current = {'last': message, 'started_at': timestamp, 'title': None, 'count': 0}
+            sessions.append(current)
+        current['started_at'] = timestamp
+        current['count'] += 1
+        if message.get('sender') == 'user':
+            # Walking backwards, so this ends up as the session's first user message
+            current['title'] = message['preview']
+
+    return [format_session(session) for session in sessions]
+
+def format_session(session: dict):
+    """Shape a session summary for the frontend chat list"""
+    last = session['last']
+    title = session['title'] or 'Conversation'
+    if len(title) > TITLE_LENGTH:
+        title = title[:TITLE_LENGTH].rstrip() + '...'
+    return {
+        'id': last['conversation'],
+        'title': title,
+        'lastMessage': last['preview'],
+        'timestamp': format_timestamp(last['timestamp']),
+        'unreadCount': 0,  # You can implement unread tracking if needed
+        'date': last['timestamp'].strftime('%Y-%m-%d'),
+        'messageCount': session['count'],
+        'startedAt': session['started_at'].isoformat(),
+        'endedAt': last['timestamp'].isoformat()
+    }
 
 def format_timestamp(timestamp):
     """Format timestamp for display"""
-    now = datetime.now()
+    now = datetime.utcnow()
     today = now.date()
     yesterday = today - timedelta(days=1)
     
@@ -1,81 +1,206 @@
+from dotenv import load_dotenv
+
+# Loaded first so the settings the modules below read at import time see .env when
+# this file is run directly; under gunicorn, gunicorn.conf.py has already loaded it
+load_dotenv()
+
 from flask import Flask, jsonify, request
 from conversation_storage import get_recent_conversations
-from database import get_conversations, get_single_conversation, add_message_to_conversation, store_conversation
+from database import (
+    get_conversations, get_conversations_after, count_conversations, get_single_conversation,
+    get_conversation_window, add_messages_to_conversation, build_message, store_conversation,
+    get_rollups, ensure_indexes, repair_summary_counters, close_client, cache
+)
+from cache import cache_stats
 from flask_cors import CORS
 import logging
-from bson import ObjectId
-from datetime import datetime
-import json
-import requests
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from rasa_client import client as rasa_client
+from realtime import sio, publish_messages
+from serialization import JSONProvider
+from metrics import timed, render_metrics
+from write_queue import WRITE_BEHIND, ENQUEUE_TIMEOUT, REPLY_ENQUEUE_TIMEOUT, get_write_queue, close_write_queue
+from response_cache import RASA_RESPONSE_CACHE, RasaResponseCache
+from search import search_conversations
+from rollups import COUNTED_METADATA, MAX_REPORT_DAYS, merge_rollups
+import queue
+import metrics
+import socketio
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging. Messages use lazy %-formatting so disabled levels cost nothing;
+# message bodies and Rasa payloads are only logged at DEBUG.
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s level=%(levelname)s logger=%(name)s %(message)s'
+)
 logger = logging.getLogger(__name__)
 
-# Rasa configuration
-RASA_URL = "http://localhost:5005"  # Default Rasa server URL
-
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
-
 app = Flask(__name__)
-app.json_encoder = JSONEncoder
+# ObjectId and datetime values are serialized by the JSON provider, so routes
+# return MongoDB documents as they are
+app.json = JSONProvider(app)
 CORS(app)
+metrics.init_app(app)
+response_cache = RasaResponseCache(rasa_client) if RASA_RESPONSE_CACHE else None
+# Serve Socket.IO (under /socket.io) from the same WSGI app
+app.wsgi_app = socketio.WSGIApp(sio, app.wsgi_app)
+
+def migrate():
+    """One-off data fixes, run once per deployment before the workers start"""
+    try:
+        fixed = repair_summary_counters()
+        if fixed:
+            logger.info("Repaired summary counters conversations=%d", fixed)
+    except Exception as e:
+        logger.error("Failed to repair summary counters error=%s", e)
+
+def init_worker():
+    """Per-process startup, run in each server worker after fork and before it serves
+
+    Importing this module opens no connections, so it can be preloaded by a
+    forking server; MongoDB and Rasa connections are opened lazily per process.
+    """
+    try:
+        ensure_indexes()
+    except Exception as e:
+        logger.error("Failed to create MongoDB indexes error=%s", e)
+    if WRITE_BEHIND:
+        # Start the flush worker now, so it replays any write-behind log left by a
+        # previous process at boot rather than when the first message arrives
+        get_write_queue()
+
+def shutdown():
+    """Flush queued writes and close this process's connections"""
+    close_write_queue()
+    if response_cache is not None:
+        response_cache.close()
+    rasa_client.close()
+    close_client()
 
 def get_rasa_response(message, sender_id):
     try:
-        logger.info(f"Sending message to Rasa: {message}")
-        response = requests.post(
-            f"{RASA_URL}/webhooks/rest/webhook",
-            json={
-                "sender": sender_id,
-                "message": message
-            },
-            timeout=10  # Add timeout to prevent hanging
-        )
-        logger.info(f"Rasa response status: {response.status_code}")
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"Rasa response data: {data}")
-            return data
-        logger.error(f"Rasa returned non-200 status: {response.status_code}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error when calling Rasa: {str(e)}")
-        return None
+        if response_cache is not None:
+            cached = response_cache.get(message, sender_id)
+            if cached is not None:
+                logger.debug("Rasa response cache hit sender_id=%s", sender_id)
+                return cached
+        logger.debug("Sending message to Rasa sender_id=%s message=%r", sender_id, message)
+        with timed("rasa_call"):
+            data = rasa_client.send_message(message, sender_id)
+        logger.debug("Rasa response sender_id=%s data=%r", sender_id, data)
+        if response_cache is not None:
+            response_cache.store(message, data)
+        return data
     except Exception as e:
-        logger.error(f"Unexpected error when calling Rasa: {str(e)}")
+        logger.error("Unexpected error when calling Rasa error=%s", e)
         return None
 
+def parse_utc(value):
+    """Parse an ISO 8601 time as naive UTC, the form timestamps are stored in
+
+    Accepts offsets and the "Z" suffix of JavaScript's toISOString(). Raises
+    ValueError for anything else.
+    """
+    parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def persist_messages(conversation_id, messages, timeout=ENQUEUE_TIMEOUT):
+    """Write messages now, or hand them to the write-behind queue when WRITE_BEHIND is on
+
+    In write-behind mode unknown conversations are only detected (and dropped) by the
+    background flush, so this returns True once the messages are queued. Raises
+    queue.Full when the queue has no room within `timeout` or is shutting down.
+    """
+    if WRITE_BEHIND:
+        try:
+            get_write_queue().enqueue(conversation_id, messages, timeout=timeout)
+        except RuntimeError as e:
+            raise queue.Full(str(e))
+        return True
+    return add_messages_to_conversation(conversation_id, messages)
+
 @app.route('/')
 def index():
     return jsonify({'message': 'Hello, World!'})
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_stats(cache))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    stats = cache_stats(cache)
+    extra = {
+        f"chatbot_cache_{name}": value for name, value in stats.items() if isinstance(value, (int, float))
+    }
+    extra['chatbot_rasa_in_flight'] = rasa_client.gate.in_flight
+    extra['chatbot_rasa_waiting'] = rasa_client.gate.waiting
+    extra['chatbot_rasa_coalesced'] = rasa_client.coalesced
+    nodes = rasa_client.node_stats()
+    extra['chatbot_rasa_nodes'] = len(nodes)
+    extra['chatbot_rasa_nodes_healthy'] = sum(1 for node in nodes if node['healthy'])
+    extra['chatbot_rasa_circuit_open'] = sum(1 for node in nodes if node['circuit'] != 'closed')
+    extra['chatbot_rasa_circuit_rejected'] = sum(node['circuit_rejected'] for node in nodes)
+    if response_cache is not None:
+        for name, value in response_cache.stats().items():
+            extra[f"chatbot_rasa_cache_{name}"] = value
+    if WRITE_BEHIND:
+        write_queue = get_write_queue()
+        extra['chatbot_write_queue_depth'] = write_queue.depth()
+        extra['chatbot_write_queue_flushed'] = write_queue.flushed
+        extra['chatbot_write_queue_failed_batches'] = write_queue.failed_batches
+    return render_metrics(extra), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/recent-chats', methods=['GET'])
 def get_conversations_list():
     try:
-        logger.info("Fetching recent conversations")
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        try:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', 20))
+        except ValueError:
+            return jsonify({'error': 'page and per_page must be integers'}), 400
+        if page < 1 or per_page < 1:
+            return jsonify({'error': 'page and per_page must be positive integers'}), 400
         user_id = request.args.get('user_id')
+        # Clients opt into keyset pagination by sending `cursor` (empty for the first page)
+        cursor = request.args.get('cursor')
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         if not user_id:
             logger.warning("No user_id provided")
+            pagination = {'per_page': per_page, 'next_cursor': None, 'has_more': False}
+            if cursor is None:
+                pagination.update({'page': page, 'total': 0, 'total_pages': 0})
             return jsonify({
                 'conversations': [],
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': 0,
-                    'total_pages': 0
-                }
+                'pagination': pagination
             })
         
-        conversations, total = get_conversations(user_id=user_id, page=page, per_page=per_page)
+        if cursor is not None:
+            try:
+                conversations, next_cursor = get_conversations_after(
+                    user_id=user_id, cursor=cursor, per_page=per_page, list_view=True
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            pagination = {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+            if include_total:
+                pagination['total'] = count_conversations(user_id)
+        else:
+            conversations, total = get_conversations(user_id=user_id, page=page, per_page=per_page, list_view=True)
+            pagination = {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'total_pages': (total + per_page - 1) // per_page
+            }
         
         # Format the response
         formatted_conversations = []
@@ -83,75 +208,136 @@ def get_conversations_list():
             try:
                 formatted_conv = {
                     'conversation_id': str(conv.get('_id')),
-                    'started_at': conv.get('started_at').isoformat() if conv.get('started_at') else None,
-                    'updated_at': conv.get('updated_at').isoformat() if conv.get('updated_at') else None,
+                    'started_at': conv.get('started_at'),
+                    'updated_at': conv.get('updated_at'),
                     'participants': conv.get('participants', {}),
                     'metadata': conv.get('metadata', {}),
                     'status': conv.get('status', 'active'),
                     'summary': conv.get('summary', {}),
                 }
                 
-                # Get the last message if available
+                # Get the last message if available (bucketed conversations keep it on the header)
                 messages = conv.get('messages', [])
+                if not messages and conv.get('last_message'):
+                    messages = [conv['last_message']]
                 if messages:
                     last_message = messages[-1]
                     formatted_conv['last_message'] = last_message.get('content', '')
-                    formatted_conv['last_message_timestamp'] = last_message.get('timestamp').isoformat() if last_message.get('timestamp') else None
+                    formatted_conv['last_message_timestamp'] = last_message.get('timestamp')
                 else:
                     formatted_conv['last_message'] = ''
                     formatted_conv['last_message_timestamp'] = None
                 
                 formatted_conversations.append(formatted_conv)
             except Exception as e:
-                logger.error(f"Error formatting conversation: {str(e)}")
+                logger.error("Error formatting conversation error=%s", e)
                 continue
         
         return jsonify({
             'conversations': formatted_conversations,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'total_pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         })
     except Exception as e:
-        logger.error(f"Error fetching conversations: {str(e)}", exc_info=True)
+        logger.error("Error fetching conversations error=%s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/search', methods=['GET'])
+def search():
+    user_id = request.args.get('user_id')
+    query = (request.args.get('q') or '').strip()
+    if not user_id or not query:
+        return jsonify({'error': 'user_id and q are required'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        results = search_conversations(user_id, query, limit=limit)
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        logger.error("Error searching conversations user_id=%s error=%s", user_id, e, exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    user_id = request.args.get('user_id')
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        return jsonify({'error': f'days must be between 1 and {MAX_REPORT_DAYS}'}), 400
+    try:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        docs = get_rollups(user_id, since=today - timedelta(days=days - 1))
+        return jsonify({
+            'user_id': user_id,
+            'days': [
+                {'day': doc['day'].strftime('%Y-%m-%d'), **merge_rollups([doc])} for doc in docs
+            ],
+            'totals': merge_rollups(docs)
+        })
+    except Exception as e:
+        logger.error("Error reading stats user_id=%s error=%s", user_id, e, exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/chat/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     try:
-        logger.info(f"Fetching conversation with ID: {conversation_id}")
-        conversation = get_single_conversation(conversation_id)
+        logger.debug("Fetching conversation conversation_id=%s", conversation_id)
+        since_message_id = request.args.get('since_message_id')
+        since = request.args.get('since')
+        before = request.args.get('before')
+        limit = request.args.get('limit')
+        windowed = any(arg is not None for arg in (since_message_id, since, before, limit))
+        if windowed:
+            try:
+                since = parse_utc(since) if since else None
+                limit = int(limit) if limit else None
+            except ValueError:
+                return jsonify({'error': 'Invalid since or limit parameter'}), 400
+            # A negative limit would flip which end of the window is kept
+            if limit is not None and limit <= 0:
+                return jsonify({'error': 'limit must be a positive integer'}), 400
+            conversation = get_conversation_window(
+                conversation_id, since_message_id=since_message_id, since=since, before=before, limit=limit
+            )
+        else:
+            conversation = get_single_conversation(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
         
-        # Convert ObjectId to string and format timestamps
-        conversation['_id'] = str(conversation['_id'])
-        conversation['started_at'] = conversation['started_at'].isoformat()
-        conversation['updated_at'] = conversation['updated_at'].isoformat()
-        
-        # Format message timestamps
-        if 'messages' in conversation:
-            for message in conversation['messages']:
-                if 'timestamp' in message:
-                    message['timestamp'] = message['timestamp'].isoformat()
-        
-        # Format summary timestamp
-        if 'summary' in conversation and 'last_message_timestamp' in conversation['summary']:
-            conversation['summary']['last_message_timestamp'] = conversation['summary']['last_message_timestamp'].isoformat()
+        if windowed:
+            # Pass cursor.before back as `before` to load the previous page of history
+            messages = conversation.get('messages', [])
+            has_older = conversation.pop('has_older', False)
+            conversation['cursor'] = {
+                'before': messages[0]['message_id'] if messages and has_older else None,
+                'has_older': has_older
+            }
         
         return jsonify(conversation)
     except Exception as e:
-        logger.error(f"Error fetching conversation: {str(e)}", exc_info=True)
+        logger.error("Error fetching conversation conversation_id=%s error=%s", conversation_id, e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+def reply_not_saved(conversation_id, user_message, replies):
+    """503 for a turn whose reply the write-behind queue had no room for
+
+    The user message is saved and Rasa has answered, so the reply is still
+    returned for the client to show.
+    """
+    logger.error("Write-behind queue full, reply not saved conversation_id=%s", conversation_id)
+    return jsonify({
+        'error': 'Server busy, reply not saved',
+        'messages': [user_message] + replies
+    }), 503
+
 @app.route('/chat/<conversation_id>/message', methods=['POST'])
 def add_message(conversation_id):
     try:
         data = request.json
-        logger.info(f"Received message data: {data}")
+        logger.debug("Received message conversation_id=%s data=%r", conversation_id, data)
         
         sender = data.get('sender')
         content = data.get('content')
@@ -160,50 +346,77 @@ def add_message(conversation_id):
         if not sender or not content:
             logger.warning("Missing required fields in message")
             return jsonify({'error': 'Missing required fields'}), 400
+        if metadata is not None and not isinstance(metadata, dict):
+            return jsonify({'error': 'metadata must be an object'}), 400
+        if metadata:
+            # Only the server's own replies may carry the fields analytics count
+            metadata = {key: value for key, value in metadata.items() if key not in COUNTED_METADATA}
+        
+        # Shed load before writing anything when too many turns are waiting on Rasa
+        if rasa_client.overloaded():
+            logger.warning("Rejecting message, Rasa queue full conversation_id=%s", conversation_id)
+            return jsonify({'error': 'Server busy, please retry'}), 503
             
         # Add user message to conversation
-        logger.info(f"Adding user message to conversation {conversation_id}")
-        success = add_message_to_conversation(conversation_id, sender, content, metadata)
+        user_message = build_message(sender, content, metadata)
+        try:
+            success = persist_messages(conversation_id, [user_message])
+        except queue.Full:
+            logger.warning("Write-behind queue full conversation_id=%s", conversation_id)
+            return jsonify({'error': 'Server busy, please retry'}), 503
         if not success:
-            logger.error(f"Failed to add message to conversation {conversation_id}")
+            logger.error("Failed to add message conversation_id=%s", conversation_id)
             return jsonify({'error': 'Failed to add message'}), 500
+        publish_messages(conversation_id, [user_message])
             
         # Get Rasa response
-        logger.info(f"Getting Rasa response for message: {content}")
+        rasa_started = time.perf_counter()
         rasa_response = get_rasa_response(content, conversation_id)
+        response_time_ms = round((time.perf_counter() - rasa_started) * 1000, 1)
         
         if rasa_response:
-            logger.info(f"Received Rasa response: {rasa_response}")
-            # Add Rasa's response to the conversation
-            for response in rasa_response:
-                if 'text' in response:
-                    success = add_message_to_conversation(
-                        conversation_id,
-                        "ai",
-                        response['text'],
-                        {
-                            "source": "rasa",
-                            "confidence": response.get('confidence', 1.0)
-                        }
-                    )
-                    if not success:
-                        logger.error(f"Failed to add Rasa response to conversation {conversation_id}")
-                        return jsonify({'error': 'Failed to add AI response'}), 500
+            # Add Rasa's whole reply to the conversation in one write
+            replies = [
+                build_message("ai", response['text'], {
+                    "source": "rasa",
+                    "confidence": response.get('confidence', 1.0)
+                })
+                for response in rasa_response if 'text' in response
+            ]
+            # The turn's latency is recorded once, on its first bubble
+            if replies:
+                replies[0]["metadata"]["response_time_ms"] = response_time_ms
+            try:
+                success = persist_messages(conversation_id, replies, timeout=REPLY_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                return reply_not_saved(conversation_id, user_message, replies)
+            if not success:
+                logger.error("Failed to add Rasa response conversation_id=%s", conversation_id)
+                return jsonify({'error': 'Failed to add AI response'}), 500
         else:
-            logger.warning("No response received from Rasa")
+            logger.warning("No response received from Rasa conversation_id=%s", conversation_id)
             # Add a default response if Rasa fails
-            success = add_message_to_conversation(
-                conversation_id,
+            replies = [build_message(
                 "ai",
                 "I'm having trouble processing your message. Please try again.",
-                {"source": "system", "error": "rasa_no_response"}
-            )
+                {"source": "system", "error": "rasa_no_response", "response_time_ms": response_time_ms}
+            )]
+            try:
+                success = persist_messages(conversation_id, replies, timeout=REPLY_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                return reply_not_saved(conversation_id, user_message, replies)
             if not success:
-                logger.error(f"Failed to add default response to conversation {conversation_id}")
+                logger.error("Failed to add default response conversation_id=%s", conversation_id)
+                replies = []
+        publish_messages(conversation_id, replies)
             
-        return jsonify({'message': 'Message added successfully'})
+        # Return the persisted messages so clients don't need to re-fetch the conversation
+        return jsonify({
+            'message': 'Message added successfully',
+            'messages': [user_message] + replies
+        })
     except Exception as e:
-        logger.error(f"Error in add_message: {str(e)}", exc_info=True)
+        logger.error("Error in add_message conversation_id=%s error=%s", conversation_id, e, exc_info=True)
         return jsonify({
             'error': 'Internal server error',
             'details': str(e)
@@ -223,23 +436,18 @@ def create_conversation():
             topic=data.get('topic'),
             timezone=data.get('timezone')
         )
-        
-        # Format timestamps for response
-        conversation['started_at'] = conversation['started_at'].isoformat()
-        conversation['updated_at'] = conversation['updated_at'].isoformat()
-        for message in conversation['messages']:
-            message['timestamp'] = message['timestamp'].isoformat()
-        if 'last_message_timestamp' in conversation['summary']:
-            conversation['summary']['last_message_timestamp'] = conversation['summary']['last_message_timestamp'].isoformat()
             
         return jsonify(conversation)
     except Exception as e:
-        logger.error(f"Error creating conversation: {str(e)}", exc_info=True)
+        logger.error("Error creating conversation error=%s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
     logger.info("Starting API server...")
     try:
+        migrate()
+        init_worker()
         app.run(host='127.0.0.1', port=8000)
     except Exception as e:
-        logger.error(f"Failed to start server: {str(e)}", exc_info=True) 
\ No newline at end of file
+        logger.error("Failed to start server error=%s", e, exc_info=True) 
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""Rebuild the daily analytics rollups from the messages already stored.
+
+    python backfill_rollups.py [--since 2024-01-01] [--until 2024-06-01] [--batch-size 500]
+
+Days in [since, until) are cleared and recounted from every conversation, in both
+storage layouts. `until` defaults to the start of today (UTC): the message write
+path keeps the current day up to date, and recounting a day that is still
+receiving live writes would double count them. Both bounds are truncated to the
+start of their day. Counts are written even when ROLLUPS is off, and a failed write
+fails the run.
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# Before database.py reads its settings at import
+load_dotenv()
+
+from database import conversations, message_buckets, rollups, ensure_indexes, write_rollups
+from rollups import day_of, rollup_increments
+
+logger = logging.getLogger(__name__)
+
+
+def in_range(messages: list, since: datetime, until: datetime):
+    return [
+        message for message in messages
+        if message.get("timestamp") and (since is None or message["timestamp"] >= since)
+        and message["timestamp"] < until
+    ]
+
+
+def backfill(since: datetime = None, until: datetime = None, batch_size: int = 500):
+    """Recount the days in [since, until) and return the number of messages counted"""
+    # The deleted days and the counted messages must cover the same range
+    since = day_of(since) if since else None
+    until = day_of(until or datetime.utcnow())
+    day_range = {"$lt": until}
+    if since:
+        day_range["$gte"] = since
+    rollups.delete_many({"day": day_range})
+
+    counted = 0
+    totals = {}
+
+    def flush():
+        write_rollups(totals)
+        totals.clear()
+
+    # Conversations can only hold messages from the window if they were updated since it began
+    query = {"conversation_id": {"$exists": True}, "storage": {"$ne": "bucketed"}}
+    if since:
+        query["updated_at"] = {"$gte": since}
+    cursor = conversations.find(query, {"participants.user.user_id": 1, "messages": 1},
+                                no_cursor_timeout=True, batch_size=batch_size)
+    try:
+        for i, conversation in enumerate(cursor, 1):
+            messages = in_range(conversation.get("messages", []), since, until)
+            user_id = conversation.get("participants", {}).get("user", {}).get("user_id")
+            rollup_increments(user_id, messages, totals)
+            counted += len(messages)
+            if i % batch_size == 0:
+                flush()
+    finally:
+        cursor.close()
+    flush()
+
+    bucket_query = {"last_timestamp": {"$gte": since}} if since else {}
+    cursor = message_buckets.find(bucket_query, {"user_id": 1, "messages": 1},
+                                  no_cursor_timeout=True, batch_size=batch_size)
+    try:
+        for i, bucket in enumerate(cursor, 1):
+            messages = in_range(bucket.get("messages", []), since, until)
+            rollup_increments(bucket.get("user_id"), messages, totals)
+            counted += len(messages)
+            if i % batch_size == 0:
+                flush()
+    finally:
+        cursor.close()
+    flush()
+    return counted
+
+
+def parse_date(value: str):
+    return datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--since', type=parse_date, help='First UTC day to rebuild (default: all history)')
+    parser.add_argument('--until', type=parse_date, help='UTC day to stop before (default: today)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    until = day_of(args.until or datetime.utcnow())
+    ensure_indexes()
+    counted = backfill(args.since, until, args.batch_size)
+    logger.info("Counted %d messages into rollups before %s", counted, until.date())
+
+
+if __name__ == '__main__':
+    main()
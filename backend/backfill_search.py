@@ -0,0 +1,55 @@
+"""Rebuild the search index of embedded conversations from the messages stored.
+
+    python backfill_search.py [--user-id USER] [--batch-size 500]
+
+The message write path keeps the index up to date; run this once after upgrading,
+or to repair it. Entries are keyed by message, so it is safe to run while the API
+is writing. Bucketed conversations are searched through their buckets and are
+not indexed here.
+"""
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+# Before database.py reads its settings at import
+load_dotenv()
+
+from database import conversations, ensure_indexes, index_messages
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(user_id: str = None, batch_size: int = 500):
+    """Index every embedded conversation (of one user) and return the number of messages seen"""
+    query = {"conversation_id": {"$exists": True}, "storage": {"$ne": "bucketed"}}
+    if user_id:
+        query["participants.user.user_id"] = user_id
+    seen = 0
+    cursor = conversations.find(query, {"participants.user.user_id": 1, "messages": 1},
+                                no_cursor_timeout=True, batch_size=batch_size)
+    try:
+        for conversation in cursor:
+            messages = conversation.get("messages", [])
+            index_messages(conversation["_id"], conversation.get("participants", {}).get("user", {}).get("user_id"),
+                           messages)
+            seen += len(messages)
+    finally:
+        cursor.close()
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--user-id', help='Only index this user\'s conversations')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ensure_indexes()
+    seen = backfill(args.user_id, args.batch_size)
+    logger.info("Indexed %d messages for search", seen)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Shared helpers for the backend benchmarks.
+
+The benchmarks talk to a real MongoDB (MONGO_URI, default localhost) but use a
+separate database so they never touch rasa_db.
+"""
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Make the backend modules importable when running `python benchmarks/<file>.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DB = os.getenv('BENCH_DB', 'rasa_bench')
+
+
+def bench_collection(name: str = 'conversations'):
+    """Return a fresh, empty collection in the benchmark database"""
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    collection = client[BENCH_DB][name]
+    collection.drop()
+    return collection
+
+
+def make_conversation(user_id: str, n_messages: int, updated_at: datetime = None):
+    """Build a conversation document in the same shape as database.store_conversation"""
+    updated_at = updated_at or datetime.utcnow()
+    started_at = updated_at - timedelta(seconds=n_messages)
+    messages = []
+    for i in range(n_messages):
+        messages.append({
+            "message_id": f"msg-{uuid.uuid4().hex[:8]}",
+            "sender": "user" if i % 2 == 0 else "ai",
+            "content": f"Message {i}: what are the admission requirements and fees for this program?",
+            "timestamp": started_at + timedelta(seconds=i),
+            "status": "delivered",
+            "metadata": {"source": "rasa", "confidence": 1.0} if i % 2 else {},
+        })
+    return {
+        "conversation_id": str(uuid.uuid4()),
+        "started_at": started_at,
+        "updated_at": updated_at,
+        "participants": {
+            "user": {"user_id": user_id, "username": user_id, "display_name": user_id},
+            "ai": {"ai_id": "grok-3", "name": "Grok", "version": "3.0"},
+        },
+        "metadata": {"platform": "web", "language": "en-US"},
+        "messages": messages,
+        "status": "active",
+        "summary": {
+            "total_messages": n_messages,
+            "last_message_id": messages[-1]["message_id"] if messages else None,
+            "last_message_timestamp": updated_at,
+        },
+    }
+
+
+def percentile(samples, pct: float):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def time_calls(fn, repeat: int):
+    """Call fn repeat times and return the per-call latencies in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    return {
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+    }
@@ -0,0 +1,50 @@
+"""Compare full documents against the list-view projection for /recent-chats.
+
+    python benchmarks/bench_conversation_list.py --conversations 50 --messages 2000
+"""
+import argparse
+import json
+
+from _common import bench_collection, make_conversation, summarize, time_calls
+
+import bson
+import database
+
+
+def payload_bytes(docs):
+    return sum(len(bson.BSON.encode(doc)) for doc in docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    collection = bench_collection()
+    collection.insert_many([
+        make_conversation("bench-user", args.messages) for _ in range(args.conversations)
+    ])
+    database.conversations = collection
+    # Time the queries themselves, not cache hits
+    database.cache = database.create_cache('none')
+
+    results = {}
+    for mode, list_view in (("full", False), ("list_view", True)):
+        def fetch():
+            return database.get_conversations(user_id="bench-user", per_page=args.per_page, list_view=list_view)
+
+        docs, _ = fetch()
+        results[mode] = {
+            "payload_bytes": payload_bytes(docs),
+            **summarize(time_calls(fetch, args.repeat)),
+        }
+
+    print(json.dumps(results, indent=2))
+    collection.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Rasa round-trip latency: one requests.post per message vs the pooled RasaClient.
+
+    python benchmarks/bench_rasa_client.py --requests 2000 --concurrency 16 --latency-ms 5
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import percentile
+from stub_rasa import start_stub
+
+import requests
+from rasa_client import RasaClient, WEBHOOK_PATH
+
+
+def run_threaded(send, total: int, concurrency: int):
+    def timed(i):
+        start = time.perf_counter()
+        send("hello", f"bench-{i % 100}")
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, range(total)))
+    return samples, time.perf_counter() - start
+
+
+def report(samples, elapsed):
+    return {
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "requests_per_sec": round(len(samples) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server, url = start_stub(latency_ms=args.latency_ms)
+
+    def unpooled(message, sender_id):
+        return requests.post(f"{url}{WEBHOOK_PATH}", json={"sender": sender_id, "message": message}, timeout=10).json()
+
+    pooled = RasaClient(url, pool_maxsize=args.concurrency)
+    results = {
+        "before_requests_post": report(*run_threaded(unpooled, args.requests, args.concurrency)),
+        "after_pooled_client": report(*run_threaded(pooled.send_message, args.requests, args.concurrency)),
+    }
+
+    print(json.dumps(results, indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
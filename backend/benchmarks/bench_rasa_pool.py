@@ -0,0 +1,73 @@
+"""Route turns across several stub Rasa servers and check stickiness, balance and failover.
+
+    python benchmarks/bench_rasa_pool.py --nodes 3 --senders 300 --concurrency 32
+
+Phases: all nodes up, one node shut down, and one node slowed down. Each phase
+reports how many turns succeeded, how many senders each node served and how many
+senders were seen by more than one node (stickiness violations).
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import percentile
+from stub_rasa import start_stub
+
+from rasa_client import RasaClient
+
+
+def run_phase(client: RasaClient, handlers, senders: int, turns: int, concurrency: int):
+    for handler in handlers:
+        handler.senders.clear()
+
+    def one(i):
+        start = time.perf_counter()
+        data = client.send_message("hello", f"sender-{i % senders}")
+        return (time.perf_counter() - start) * 1000, data is not None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(senders * turns)))
+    samples = [elapsed for elapsed, _ in results]
+    seen = [set(handler.senders) for handler in handlers]
+    split = set.union(*(a & b for i, a in enumerate(seen) for b in seen[i + 1:])) if len(seen) > 1 else set()
+    return {
+        "ok": sum(1 for _, ok in results if ok),
+        "failed": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "senders_per_node": [len(s) for s in seen],
+        "senders_on_several_nodes": len(split),
+        "nodes": client.node_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--senders', type=int, default=300)
+    parser.add_argument('--turns', type=int, default=5, help='Turns per sender in each phase')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    stubs = [start_stub(latency_ms=args.latency_ms) for _ in range(args.nodes)]
+    handlers = [server.RequestHandlerClass for server, _ in stubs]
+    client = RasaClient([url for _, url in stubs], read_timeout=2, retries=2, health_interval=0.5)
+
+    results = {"all_up": run_phase(client, handlers, args.senders, args.turns, args.concurrency)}
+
+    handlers[-1].down = True
+    results["one_down"] = run_phase(client, handlers, args.senders, args.turns, args.concurrency)
+
+    handlers[0].latency = args.latency_ms * 20 / 1000.0
+    results["one_slow"] = run_phase(client, handlers, args.senders, args.turns, args.concurrency)
+
+    print(json.dumps(results, indent=2))
+    client.close()
+    for server, _ in stubs:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
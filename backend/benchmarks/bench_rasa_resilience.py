@@ -0,0 +1,66 @@
+"""Exercise the Rasa circuit breaker and concurrency gate against a misbehaving stub.
+
+    python benchmarks/bench_rasa_resilience.py --concurrency 64
+
+Runs three phases (healthy, slow + failing, recovered) and reports, per phase,
+how many calls succeeded, failed fast or were shed, and the p50/p99 latency.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import percentile
+from stub_rasa import start_stub
+
+from rasa_client import CircuitBreaker, ConcurrencyGate, RasaClient
+
+
+def run_phase(client: RasaClient, total: int, concurrency: int):
+    def one(i):
+        start = time.perf_counter()
+        data = client.send_message("hello", f"bench-{i}")
+        return (time.perf_counter() - start) * 1000, data is not None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    samples = [elapsed for elapsed, _ in results]
+    return {
+        "ok": sum(1 for _, ok in results if ok),
+        "failed": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "circuit": client.nodes[0].breaker.state,
+        "circuit_rejected_total": client.nodes[0].breaker.rejected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--max-concurrency', type=int, default=8)
+    parser.add_argument('--max-queue', type=int, default=16)
+    args = parser.parse_args()
+
+    server, url = start_stub(latency_ms=5)
+    handler = server.RequestHandlerClass
+    client = RasaClient(url, read_timeout=0.5, retries=0)
+    client.nodes[0].breaker = CircuitBreaker(failure_threshold=5, reset_timeout=1.0)
+    client.gate = ConcurrencyGate(args.max_concurrency, args.max_queue, queue_timeout=0.5)
+
+    results = {"healthy": run_phase(client, args.requests, args.concurrency)}
+
+    handler.latency, handler.error_rate = 0.2, 0.5
+    results["degraded"] = run_phase(client, args.requests, args.concurrency)
+
+    handler.latency, handler.error_rate = 0.005, 0.0
+    time.sleep(client.nodes[0].breaker.reset_timeout)
+    results["recovered"] = run_phase(client, args.requests, args.concurrency)
+
+    print(json.dumps(results, indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Full-text search latency on a generated corpus, against scanning conversations client-side.
+
+    python benchmarks/bench_search.py --messages 1000000 --users 1000 --per-conversation 50 [--storage embedded]
+
+Seeds `--messages` messages spread over `--users` users in the given layout, builds
+the indexes from database.ensure_indexes, then times search_conversations for
+random users and words. The baseline is what the app does without /search: fetch
+every conversation of the user and scan message content for the word. Appends are
+timed as well, since the search indexes are maintained on every message write.
+"""
+import argparse
+import json
+import random
+import time
+
+from _common import bench_collection, make_conversation, summarize, time_calls
+
+import database
+import search
+
+WORDS = (
+    "admission requirements fees tuition scholarship deadline transcript exam schedule campus housing "
+    "library semester course registration advisor graduation internship visa loan refund hostel "
+    "laboratory lecture timetable portal password library certificate engineering nursing business"
+).split()
+
+
+def seed(collection, args, rng: random.Random):
+    conversations = args.messages // args.per_conversation
+    batch = []
+    for i in range(conversations):
+        conversation = make_conversation(f"user-{i % args.users}", args.per_conversation)
+        for message in conversation["messages"]:
+            message["content"] = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))
+        if args.storage == "bucketed":
+            database._insert_bucketed(conversation)
+            continue
+        batch.append(conversation)
+        if len(batch) == 1000:
+            insert_embedded(collection, batch)
+            batch = []
+    if batch:
+        insert_embedded(collection, batch)
+    return conversations
+
+
+def insert_embedded(collection, batch: list):
+    collection.insert_many(batch)
+    database.message_terms.insert_many([
+        entry for conversation in batch
+        for entry in database.search_entries(conversation["_id"], conversation["participants"]["user"]["user_id"],
+                                             conversation["messages"])
+    ])
+
+
+def scan(collection, buckets, user_id: str, word: str):
+    """Baseline: load every message of the user and look for the word"""
+    hits = set()
+    for conversation in collection.find({"participants.user.user_id": user_id}):
+        if any(word in (message.get("content") or "") for message in conversation.get("messages", [])):
+            hits.add(conversation["_id"])
+    for bucket in buckets.find({"user_id": user_id}):
+        if any(word in (message.get("content") or "") for message in bucket["messages"]):
+            hits.add(bucket["conversation"])
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--per-conversation', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--storage', choices=['embedded', 'bucketed'], default='bucketed')
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    collection = bench_collection('conversations')
+    buckets = bench_collection('message_buckets')
+    database.conversations = search.conversations = collection
+    database.message_buckets = search.message_buckets = buckets
+    database.rollups = bench_collection('rollups')
+    database.message_terms = search.message_terms = bench_collection('message_terms')
+    database.cache = database.create_cache('none')
+    start = time.perf_counter()
+    conversations = seed(collection, args, rng)
+    seed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    database.ensure_indexes()
+    index_seconds = time.perf_counter() - start
+    conversation_ids = [doc["conversation_id"] for doc in collection.find({}, {"conversation_id": 1}).limit(1000)]
+
+    def pick():
+        return f"user-{rng.randrange(args.users)}", rng.choice(WORDS)
+
+    queries = [pick() for _ in range(args.queries)]
+    it = iter(queries * 2)
+    results = {
+        "corpus": {"messages": conversations * args.per_conversation, "conversations": conversations,
+                   "users": args.users, "seed_s": round(seed_seconds, 1), "index_build_s": round(index_seconds, 1)},
+        "storage": args.storage,
+        "search": summarize(time_calls(lambda: search.search_conversations(*next(it)), args.queries)),
+        "client_scan": summarize(time_calls(lambda: scan(collection, buckets, *next(it)), args.queries)),
+        "append": summarize(time_calls(lambda: database.add_message_to_conversation(
+            rng.choice(conversation_ids), "user", " ".join(rng.choice(WORDS) for _ in range(12))
+        ), args.queries)),
+    }
+    if args.storage == "bucketed":
+        results["text_index_mb"] = round(buckets.database.command("collStats", buckets.name)
+                                         ["indexSizes"]["user_message_text"] / 2 ** 20, 1)
+    else:
+        stats = database.message_terms.database.command("collStats", database.message_terms.name)
+        results["search_index_mb"] = round((stats["size"] + stats["totalIndexSize"]) / 2 ** 20, 1)
+    print(json.dumps(results, indent=2))
+    collection.drop()
+    buckets.drop()
+    database.rollups.drop()
+    database.message_terms.drop()
+
+
+if __name__ == '__main__':
+    main()
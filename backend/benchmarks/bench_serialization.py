@@ -0,0 +1,68 @@
+"""Serialize conversations of 10 to 10k messages: old per-field isoformat loop vs the JSON provider.
+
+    python benchmarks/bench_serialization.py --sizes 10 100 1000 10000
+"""
+import argparse
+import copy
+import json
+import time
+import tracemalloc
+
+from _common import make_conversation
+
+from bson import ObjectId
+import serialization
+
+
+def legacy_dumps(conversation: dict):
+    """What the routes did before: convert every datetime in place, then json.dumps"""
+    conversation['_id'] = str(conversation['_id'])
+    conversation['started_at'] = conversation['started_at'].isoformat()
+    conversation['updated_at'] = conversation['updated_at'].isoformat()
+    for message in conversation['messages']:
+        message['timestamp'] = message['timestamp'].isoformat()
+    conversation['summary']['last_message_timestamp'] = conversation['summary']['last_message_timestamp'].isoformat()
+    return json.dumps(conversation)
+
+
+def measure(fn, conversation: dict, repeat: int, copy_input: bool):
+    inputs = [copy.deepcopy(conversation) if copy_input else conversation for _ in range(repeat)]
+    start = time.perf_counter()
+    for doc in inputs:
+        fn(doc)
+    elapsed = time.perf_counter() - start
+
+    sample = copy.deepcopy(conversation) if copy_input else conversation
+    tracemalloc.start()
+    fn(sample)
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return {
+        "docs_per_sec": round(repeat / elapsed, 1),
+        "peak_bytes": peak,
+        "allocations": sum(stat.count for stat in snapshot.statistics('filename')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    results = {"orjson": serialization.orjson is not None}
+    for size in args.sizes:
+        conversation = make_conversation("bench-user", size)
+        conversation["_id"] = ObjectId()
+        # The legacy path mutates its input, so it gets a fresh copy per call
+        results[size] = {
+            "legacy": measure(legacy_dumps, conversation, args.repeat, copy_input=True),
+            "provider": measure(serialization.dumps, conversation, args.repeat, copy_input=False),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
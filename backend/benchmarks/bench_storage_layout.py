@@ -0,0 +1,60 @@
+"""Append and read-window latency for the embedded vs bucketed message layouts.
+
+    python benchmarks/bench_storage_layout.py --sizes 10 1000 50000
+"""
+import argparse
+import json
+
+from _common import BENCH_DB, bench_collection, make_conversation, summarize, time_calls
+
+import database
+
+
+def seed(layout: str, n_messages: int):
+    """Insert one conversation with n_messages in the given layout and return its id"""
+    conversation = make_conversation("bench-user", n_messages)
+    if layout == "bucketed":
+        database._insert_bucketed(conversation)
+    else:
+        database.conversations.insert_one(conversation)
+    return conversation["conversation_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 50000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--window', type=int, default=50)
+    args = parser.parse_args()
+
+    database.conversations = bench_collection('conversations')
+    database.message_buckets = bench_collection('message_buckets')
+    database.rollups = bench_collection('rollups')
+    database.message_terms = bench_collection('message_terms')
+    database.cache = database.create_cache('none')
+    database.ensure_indexes()
+
+    results = {}
+    for layout in ("embedded", "bucketed"):
+        database.MESSAGE_STORAGE = layout
+        for size in args.sizes:
+            conversation_id = seed(layout, size)
+            append = time_calls(
+                lambda: database.add_message_to_conversation(conversation_id, "user", "benchmark message"),
+                args.repeat,
+            )
+            window = time_calls(
+                lambda: database.get_conversation_window(conversation_id, limit=args.window),
+                args.repeat,
+            )
+            results[f"{layout}/{size}"] = {"append": summarize(append), "read_window": summarize(window)}
+
+    print(json.dumps({"database": BENCH_DB, "results": results}, indent=2))
+    database.conversations.drop()
+    database.message_buckets.drop()
+    database.rollups.drop()
+    database.message_terms.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Print the winning plan of the hot conversation queries and fail on a COLLSCAN.
+
+    python benchmarks/check_indexes.py
+"""
+import sys
+
+from _common import bench_collection, make_conversation
+
+import database
+
+
+def plan_stages(plan: dict):
+    """Flatten the stage names of a queryPlanner winningPlan"""
+    stages = [plan.get("stage")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(plan_stages(child))
+    return stages
+
+
+def main():
+    collection = bench_collection()
+    docs = [make_conversation(f"user-{i % 20}", 5) for i in range(500)]
+    collection.insert_many(docs)
+    database.conversations = collection
+    database.message_buckets = bench_collection('message_buckets')
+    database.rollups = bench_collection('rollups')
+    database.message_terms = bench_collection('message_terms')
+    database.ensure_indexes()
+
+    sample = docs[123]
+    queries = {
+        "by conversation_id": (database.conversation_query(sample["conversation_id"]), None),
+        "by _id": (database.conversation_query(str(sample["_id"])), None),
+        "recent chats page": (
+            {"participants.user.user_id": "user-3"},
+            [("updated_at", -1), ("_id", -1)],
+        ),
+    }
+
+    failed = False
+    for name, (query, sort) in queries.items():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+        print(f"{name}: {' <- '.join(s for s in stages if s)}")
+        failed = failed or "COLLSCAN" in stages or "SORT" in stages
+
+    for bench in (collection, database.message_buckets, database.rollups, database.message_terms):
+        bench.drop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
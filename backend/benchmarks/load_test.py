@@ -0,0 +1,181 @@
+"""Offline load test for the Flask API with a stub Rasa webhook and a seeded MongoDB.
+
+    python benchmarks/load_test.py --users 20 --conversations 10 --messages 200 \\
+        --concurrency 16 --requests 500 --rasa-latency-ms 20 --output results.json
+
+Pass --mongomock to run without a mongod (requires the mongomock package). Results
+(throughput, p50/p95/p99 and Mongo operations per request for each route) are
+written as JSON, tagged with the current git commit, so runs can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import BENCH_DB, make_conversation, percentile
+from stub_rasa import start_stub
+
+# Collection methods that each cost one round trip to MongoDB
+MONGO_OPS = {
+    'find_one', 'find', 'aggregate', 'count_documents', 'estimated_document_count', 'insert_one',
+    'insert_many', 'update_one', 'update_many', 'find_one_and_update', 'bulk_write', 'delete_many',
+}
+
+
+class CountingCollection:
+    """Collection proxy that counts driver calls, for both pymongo and mongomock"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+        self.ops = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in MONGO_OPS:
+            return attr
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.ops += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+def setup_database(args):
+    """Point database.py at a freshly seeded benchmark database"""
+    import database
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    db = client[BENCH_DB]
+    for name in ('conversations', 'message_buckets', 'rollups', 'message_terms'):
+        db[name].drop()
+
+    seeded = []
+    for u in range(args.users):
+        batch = [make_conversation(f"user-{u}", args.messages) for _ in range(args.conversations)]
+        db['conversations'].insert_many(batch)
+        seeded.extend((doc['conversation_id'], f"user-{u}") for doc in batch)
+
+    database.conversations = CountingCollection(db['conversations'])
+    database.message_buckets = CountingCollection(db['message_buckets'])
+    database.rollups = CountingCollection(db['rollups'])
+    database.message_terms = CountingCollection(db['message_terms'])
+    return database, db, seeded
+
+
+def run_scenario(make_request, total: int, concurrency: int, collections):
+    import requests
+
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = make_request(local.session, i)
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, response.status_code < 400
+
+    ops_before = sum(c.ops for c in collections)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    ops = sum(c.ops for c in collections) - ops_before
+
+    samples = [elapsed for elapsed, _ in results]
+    return {
+        "requests": total,
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput_rps": round(total / wall, 1),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "mongo_ops_per_request": round(ops / total, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--conversations', type=int, default=10, help='Conversations per user')
+    parser.add_argument('--messages', type=int, default=200, help='Messages per conversation')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route')
+    parser.add_argument('--rasa-latency-ms', type=float, default=20.0)
+    parser.add_argument('--mongomock', action='store_true')
+    parser.add_argument('--output', help='Write the JSON results here as well as to stdout')
+    args = parser.parse_args()
+
+    # Rasa and logging are configured from the environment when the API is imported
+    rasa_server, rasa_url = start_stub(latency_ms=args.rasa_latency_ms)
+    os.environ['RASA_URL'] = rasa_url
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    database, db, seeded = setup_database(args)
+    from api import app, init_worker
+    from werkzeug.serving import make_server
+
+    init_worker()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    collections = [database.conversations, database.message_buckets, database.rollups, database.message_terms]
+    rng = random.Random(42)
+
+    def pick():
+        return seeded[rng.randrange(len(seeded))]
+
+    scenarios = {
+        "POST /chat": lambda s, i: s.post(f"{base_url}/chat", json={
+            "user_id": f"user-{i % args.users}", "username": "bench", "display_name": "Bench", "message": "hello"
+        }),
+        "POST /chat/<id>/message": lambda s, i: s.post(
+            f"{base_url}/chat/{pick()[0]}/message", json={"sender": "user", "content": "What are the fees?"}
+        ),
+        "GET /chat/<id>": lambda s, i: s.get(f"{base_url}/chat/{pick()[0]}"),
+        "GET /recent-chats": lambda s, i: s.get(f"{base_url}/recent-chats", params={"user_id": pick()[1]}),
+    }
+
+    results = {
+        "commit": git_commit(),
+        "config": vars(args),
+        "routes": {
+            name: run_scenario(request, args.requests, args.concurrency, collections)
+            for name, request in scenarios.items()
+        },
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    server.shutdown()
+    rasa_server.shutdown()
+    db['conversations'].drop()
+    db['message_buckets'].drop()
+    db['message_terms'].drop()
+
+
+if __name__ == '__main__':
+    main()
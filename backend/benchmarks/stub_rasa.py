@@ -0,0 +1,94 @@
+"""Minimal stand-in for the Rasa REST webhook, for offline benchmarks.
+
+    python benchmarks/stub_rasa.py --port 5005 --latency-ms 50
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubRasaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real Rasa server
+    # Headers and body go out in separate writes; without TCP_NODELAY a reused
+    # connection stalls on delayed ACKs
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0
+    replies = ["Hey! How are you?"]
+    senders = set()
+    down = False
+    malformed = False
+
+    def do_GET(self):
+        body = b"Hello from Rasa stub"
+        self.send_response(503 if self.down else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.down:
+            # Drop the connection without answering, like a crashed server
+            self.close_connection = True
+            return
+        self.senders.add(payload.get("sender"))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps([
+            {"recipient_id": payload.get("sender"), "text": text} for text in self.replies
+        ]).encode()
+        if self.malformed:
+            body = b"<html>Bad Gateway</html>"
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port: int = 0, latency_ms: float = 0.0, replies=None, error_rate: float = 0.0):
+    """Start the stub in a daemon thread and return (server, base_url)
+
+    The handler class is exposed as `server.RequestHandlerClass`, so latency and
+    error_rate can be changed while it runs, `down` makes it drop every webhook call,
+    `malformed` makes it answer 200 with a body that isn't JSON, and its `senders` set records every sender_id the stub has served.
+    """
+    handler = type('Handler', (StubRasaHandler,), {
+        'latency': latency_ms / 1000.0,
+        'error_rate': error_rate,
+        'replies': replies or StubRasaHandler.replies,
+        'senders': set(),
+    })
+    # A deeper listen backlog than the default 5, so bursts of new connections aren't reset
+    server_class = type('Server', (ThreadingHTTPServer,), {'request_queue_size': 128})
+    server = server_class(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+    args = parser.parse_args()
+    server, url = start_stub(args.port, args.latency_ms, error_rate=args.error_rate)
+    print(f"Stub Rasa listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,217 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration defaults. create_cache() reads the CACHE_BACKEND, CACHE_TTL,
+# CACHE_MAX_ENTRIES and REDIS_URL environment variables when it is called, so
+# whatever .env the entry point loaded applies.
+CACHE_BACKEND = 'memory'  # memory, redis or none
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 10000
+REDIS_URL = 'redis://localhost:6379/0'
+
+
+class CacheStats:
+    """Hit/miss/eviction counters shared by the cache backends"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class LRUCache:
+    """In-process cache with per-entry TTL and least-recently-used eviction.
+
+    Values are stored pickled so callers can freely mutate what they get back.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        # Generation counters live outside the LRU so eviction can never reset them
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats.incr("misses")
+                return None
+            self._entries.move_to_end(key)
+        self.stats.incr("hits")
+        return pickle.loads(entry[1])
+
+    def peek(self, key: str):
+        """get() without counting a hit or miss, for bookkeeping entries"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def set(self, key: str, value, ttl: int = None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.stats.incr("invalidations")
+
+    def incr(self, key: str):
+        """Atomically bump an integer counter (used for namespace generations)"""
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+        self.stats.incr("invalidations")
+        return value
+
+    def counter(self, key: str):
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """Cache shared between API processes, stored in Redis with a TTL per key"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = CACHE_TTL, prefix: str = "chatbot:", client=None):
+        if client is None:
+            import redis  # Only needed when the redis backend is selected
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key: str):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return pickle.loads(data)
+
+    def peek(self, key: str):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key: str, value, ttl: int = None):
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl or self.ttl)
+
+    def delete(self, *keys: str):
+        if keys:
+            removed = self.client.delete(*(self.prefix + key for key in keys))
+            self.stats.incr("invalidations", removed)
+
+    def incr(self, key: str):
+        self.stats.incr("invalidations")
+        return self.client.incr(self.prefix + key)
+
+    def counter(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else 0
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats_dict(self):
+        stats = self.stats.as_dict()
+        # Evictions happen inside Redis, so report its own counter
+        stats["evictions"] = self.client.info("stats").get("evicted_keys", 0)
+        return stats
+
+
+class NullCache:
+    """Backend used when caching is disabled: every lookup misses"""
+
+    name = "none"
+    ttl = 0
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: str):
+        return None
+
+    def peek(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: int = None):
+        pass
+
+    def delete(self, *keys: str):
+        pass
+
+    def incr(self, key: str):
+        return 0
+
+    def counter(self, key: str):
+        return 0
+
+    def clear(self):
+        pass
+
+
+def create_cache(backend: str = None):
+    """Build the cache backend selected by CACHE_BACKEND"""
+    backend = backend or os.getenv('CACHE_BACKEND', CACHE_BACKEND)
+    ttl = int(os.getenv('CACHE_TTL', CACHE_TTL))
+    if backend == "redis":
+        return RedisCache(os.getenv('REDIS_URL', REDIS_URL), ttl)
+    if backend == "none":
+        return NullCache()
+    return LRUCache(int(os.getenv('CACHE_MAX_ENTRIES', CACHE_MAX_ENTRIES)), ttl)
+
+
+def cache_stats(cache):
+    """Return the counters of any backend as a dict"""
+    if hasattr(cache, "stats_dict"):
+        stats = cache.stats_dict()
+    else:
+        stats = cache.stats.as_dict()
+    stats["backend"] = cache.name
+    return stats
@@ -0,0 +1,227 @@
+"""Stream conversations to and from newline-delimited JSON.
+
+    python conversation_dump.py export conversations.ndjson.gz [--user-id USER] \\
+        [--since 2024-01-01] [--until 2024-02-01] [--batch-size 1000] [--checkpoint export.ckpt]
+    python conversation_dump.py import conversations.ndjson.gz [--upsert] [--checkpoint import.ckpt]
+
+Files ending in .gz are gzip-compressed. One conversation per line, in MongoDB
+extended JSON and always in the embedded layout: bucketed conversations are
+reassembled on export, and imported conversations can be moved back into buckets
+with migrate_buckets.py.
+
+Both directions work a batch at a time, so memory stays bounded whatever the file
+size. With --checkpoint, progress is saved after every batch and a rerun with the
+same arguments carries on from there. An export writes each batch as its own gzip
+member and records the file offset, so a resumed export first drops anything
+written after the last checkpoint. Imports skip conversations whose _id already
+exists (or replace them with --upsert), so replaying a batch is harmless.
+Imported messages are added to the search index as each batch is written.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+# Before database.py reads its settings at import
+load_dotenv()
+
+from database import conversations, message_buckets, message_terms, ensure_indexes, clear_cache, index_messages
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+
+def load_checkpoint(path: str):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, state: dict):
+    if not path:
+        return
+    # Write then rename, so a crash never leaves a half-written checkpoint
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def build_query(user_id: str = None, since: datetime = None, until: datetime = None):
+    query = {"conversation_id": {"$exists": True}}
+    if user_id:
+        query["participants.user.user_id"] = user_id
+    if since or until:
+        query["updated_at"] = {}
+        if since:
+            query["updated_at"]["$gte"] = since
+        if until:
+            query["updated_at"]["$lt"] = until
+    return query
+
+
+def matches(conversation: dict, user_id: str = None, since: datetime = None, until: datetime = None):
+    """Python twin of build_query, for filtering an import"""
+    if user_id and conversation.get("participants", {}).get("user", {}).get("user_id") != user_id:
+        return False
+    updated_at = conversation.get("updated_at")
+    if since and (updated_at is None or updated_at < since):
+        return False
+    if until and (updated_at is None or updated_at >= until):
+        return False
+    return True
+
+
+def to_embedded_shape(batch: list):
+    """Fill in the messages of bucketed conversations, with one bucket query per batch"""
+    bucketed = {conversation["_id"]: conversation for conversation in batch if conversation.get("storage") == "bucketed"}
+    if not bucketed:
+        return batch
+    for conversation in bucketed.values():
+        conversation["messages"] = []
+        conversation.pop("storage")
+        conversation.pop("last_message", None)
+    cursor = message_buckets.find({"conversation": {"$in": list(bucketed)}}).sort(
+        [("conversation", ASCENDING), ("seq", ASCENDING)]
+    )
+    for bucket in cursor:
+        bucketed[bucket["conversation"]]["messages"].extend(bucket["messages"])
+    return batch
+
+
+def export_conversations(path: str, query: dict, batch_size: int = 1000, checkpoint: str = None):
+    state = load_checkpoint(checkpoint)
+    if state.get("last_id"):
+        query = {**query, "_id": {"$gt": ObjectId(state["last_id"])}}
+    compress = path.endswith('.gz')
+    exported = state.get("exported", 0)
+
+    with open(path, 'r+b' if state else 'wb') as f:
+        f.seek(state.get("offset", 0))
+        f.truncate()
+        cursor = conversations.find(query, no_cursor_timeout=True, batch_size=batch_size).sort("_id", ASCENDING)
+        try:
+            batch = []
+            for conversation in cursor:
+                batch.append(conversation)
+                if len(batch) >= batch_size:
+                    exported += _write_batch(f, batch, compress)
+                    save_checkpoint(checkpoint, {"last_id": str(batch[-1]["_id"]), "offset": f.tell(), "exported": exported})
+                    batch = []
+            if batch:
+                exported += _write_batch(f, batch, compress)
+                save_checkpoint(checkpoint, {"last_id": str(batch[-1]["_id"]), "offset": f.tell(), "exported": exported})
+        finally:
+            cursor.close()
+    return exported
+
+
+def _write_batch(f, batch: list, compress: bool):
+    data = "".join(json_util.dumps(conversation, json_options=JSON_OPTIONS) + "\n"
+                   for conversation in to_embedded_shape(batch)).encode('utf-8')
+    f.write(gzip.compress(data) if compress else data)
+    f.flush()
+    os.fsync(f.fileno())
+    return len(batch)
+
+
+def import_conversations(path: str, batch_size: int = 1000, upsert: bool = False, checkpoint: str = None,
+                         **filters):
+    state = load_checkpoint(checkpoint)
+    skip_lines = state.get("lines", 0)
+    counts = {"inserted": state.get("inserted", 0), "existing": state.get("existing", 0)}
+    opener = gzip.open if path.endswith('.gz') else open
+
+    def flush(batch: list, lines: int):
+        if batch:
+            inserted, existing = _write_conversations(batch, upsert)
+            _index_conversations(batch, upsert)
+            counts["inserted"] += inserted
+            counts["existing"] += existing
+        save_checkpoint(checkpoint, {"lines": lines, **counts})
+
+    with opener(path, 'rt', encoding='utf-8') as f:
+        batch = []
+        lines = 0
+        for lines, line in enumerate(f, 1):
+            if lines <= skip_lines or not line.strip():
+                continue
+            conversation = json_util.loads(line, json_options=JSON_OPTIONS)
+            if matches(conversation, **filters):
+                batch.append(conversation)
+            if len(batch) >= batch_size:
+                flush(batch, lines)
+                batch = []
+        flush(batch, max(lines, skip_lines))
+
+    clear_cache()
+    return counts
+
+
+def _write_conversations(batch: list, upsert: bool):
+    """Returns (written, already present)"""
+    if upsert:
+        result = conversations.bulk_write(
+            [ReplaceOne({"_id": conversation["_id"]}, conversation, upsert=True) for conversation in batch],
+            ordered=False
+        )
+        return result.upserted_count, result.matched_count
+    try:
+        result = conversations.insert_many(batch, ordered=False)
+        return len(result.inserted_ids), 0
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get("nInserted", 0), len(errors)
+
+
+def _index_conversations(batch: list, replaced: bool):
+    """Add a written batch to the search index, dropping replaced conversations' old entries"""
+    if replaced:
+        message_terms.delete_many({"conversation": {"$in": [conversation["_id"] for conversation in batch]}})
+    for conversation in batch:
+        user_id = conversation.get("participants", {}).get("user", {}).get("user_id")
+        index_messages(conversation["_id"], user_id, conversation.get("messages", []))
+
+
+def parse_date(value: str):
+    return datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('direction', choices=['export', 'import'])
+    parser.add_argument('path', help='NDJSON file; .gz for gzip')
+    parser.add_argument('--user-id', help='Only this user\'s conversations')
+    parser.add_argument('--since', type=parse_date, help='Only conversations updated at or after this UTC date')
+    parser.add_argument('--until', type=parse_date, help='Only conversations updated before this UTC date')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--checkpoint', help='Save progress here and resume from it')
+    parser.add_argument('--upsert', action='store_true', help='Replace conversations that already exist on import')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.direction == 'export':
+        query = build_query(args.user_id, args.since, args.until)
+        exported = export_conversations(args.path, query, args.batch_size, args.checkpoint)
+        logger.info("Exported %d conversations to %s", exported, args.path)
+    else:
+        ensure_indexes()
+        counts = import_conversations(args.path, args.batch_size, args.upsert, args.checkpoint,
+                                      user_id=args.user_id, since=args.since, until=args.until)
+        logger.info("Imported %d conversations from %s, %d already present",
+                    counts["inserted"], args.path, counts["existing"])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,28 @@
-from database import get_conversations
+from database import get_recent_activity, iter_recent_activity
 from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
+def format_recent_conversation(conv: dict):
+    """Flatten a conversation header and its last message into a recent-activity entry"""
+    messages = conv.get('messages') or []
+    last_message = messages[-1] if messages else conv.get('last_message') or {}
+    updated_at = conv.get('updated_at')
+    return {
+        'id': str(conv.get('_id')),
+        'conversation_id': conv.get('conversation_id'),
+        'user_id': conv.get('participants', {}).get('user', {}).get('user_id'),
+        'status': conv.get('status'),
+        'total_messages': conv.get('summary', {}).get('total_messages'),
+        'last_message': {
+            'sender': last_message.get('sender'),
+            'content': last_message.get('content'),
+            'timestamp': last_message['timestamp'].isoformat() if last_message.get('timestamp') else None
+        },
+        'updated_at': updated_at.isoformat() if updated_at else None
+    }
+
 def get_recent_conversations(limit: int = 10, hours: int = 24):
     """
     Get recent conversations from the last specified hours.
@@ -13,32 +32,33 @@ def get_recent_conversations(limit: int = 10, hours: int = 24):
         hours (int): Number of hours to look back for conversations
         
     Returns:
-        list: List of recent conversations
+        list: List of recent conversations, most recently updated first
     """
     try:
         # Calculate the cutoff time
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
         
-        # Get conversations from the database
-        conversations = get_conversations(limit=limit)
-        
-        # Filter conversations by timestamp and format them
-        recent_conversations = []
-        for conv in conversations:
-            if conv.get('timestamp', datetime.min) >= cutoff_time:
-                recent_conversations.append({
-                    'id': str(conv.get('_id')),
-                    'sender_id': conv.get('sender_id'),
-                    'message': conv.get('message'),
-                    'response': conv.get('response'),
-                    'timestamp': conv.get('timestamp').isoformat() if conv.get('timestamp') else None,
-                    'intent': conv.get('intent'),
-                    'confidence': conv.get('confidence'),
-                    'entities': conv.get('entities')
-                })
+        # The cutoff and limit are applied by MongoDB, so exactly `limit` matches come back
+        conversations = get_recent_activity(cutoff_time, limit=limit)
+        recent_conversations = [format_recent_conversation(conv) for conv in conversations]
         
-        logger.info(f"Retrieved {len(recent_conversations)} recent conversations")
+        logger.debug("Retrieved recent conversations count=%d", len(recent_conversations))
         return recent_conversations
     except Exception as e:
-        logger.error(f"Error getting recent conversations: {str(e)}")
-        raise 
\ No newline at end of file
+        logger.error("Error getting recent conversations error=%s", e)
+        raise
+
+def iter_recent_conversations(hours: int = 24, batch_size: int = 500):
+    """
+    Stream every conversation updated in the last specified hours.
+    
+    Args:
+        hours (int): Number of hours to look back for conversations
+        batch_size (int): Conversations fetched from MongoDB per round trip
+        
+    Yields:
+        dict: Recent conversations in the same format as get_recent_conversations
+    """
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+    for conv in iter_recent_activity(cutoff_time, batch_size=batch_size):
+        yield format_recent_conversation(conv)
@@ -1,19 +1,170 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 import os
-from dotenv import load_dotenv
+import json
+import base64
+import heapq
+import threading
 from bson import ObjectId
 import uuid
+from cache import create_cache
+from metrics import timed
+from rollups import ALL_USERS, rollup_increments
+from search_index import terms
 
-load_dotenv()
+# MongoDB connection. The client is created on first use in each process: a
+# MongoClient is not fork-safe, so one opened before a server forks its workers
+# must not be shared with them. Importing this module does no connection work;
+# entry points load .env before importing it (see gunicorn.conf.py).
+MONGO_DB = 'rasa_db'
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
-# MongoDB connection
-MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
-client = MongoClient(MONGO_URI)
+def get_client():
+    """Return this process's MongoClient, creating it on first use"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # A client inherited from the parent is abandoned, not closed: its
+                # sockets and monitor threads belong to the parent process
+                _client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+                _client_pid = os.getpid()
+    return _client
 
-# Ensure database exists
-db = client['rasa_db']
-conversations = db['conversations']
+def get_db():
+    return get_client()[MONGO_DB]
+
+def close_client():
+    """Close this process's MongoClient, if it has one"""
+    global _client
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+
+class LazyCollection:
+    """Stand-in for a Collection that resolves against this process's client on each use"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._client = None
+        self._collection = None
+
+    def __getattr__(self, attr):
+        client = get_client()
+        if client is not self._client:
+            self._collection = client[MONGO_DB][self.name]
+            self._client = client
+        return getattr(self._collection, attr)
+
+conversations = LazyCollection('conversations')
+message_buckets = LazyCollection('message_buckets')
+rollups = LazyCollection('rollups')
+message_terms = LazyCollection('message_terms')
+
+# Message layout for new conversations. "embedded" keeps every message inside the
+# conversation document; "bucketed" keeps a slim header in `conversations` and the
+# messages in fixed-size `message_buckets` documents. Reads and writes follow the
+# layout recorded on each conversation (`storage`), so both can coexist.
+MESSAGE_STORAGE = os.getenv('MESSAGE_STORAGE', 'embedded')
+BUCKET_SIZE = int(os.getenv('MESSAGE_BUCKET_SIZE', '100'))
+
+# Projection for list views: header fields plus only the newest message, so
+# long conversations don't ship their whole message history to the client
+LIST_PROJECTION = {"messages": {"$slice": -1}}
+
+# Fields needed to list recently active conversations: the header plus the last
+# message (embedded layout) or the denormalized last_message (bucketed layout)
+RECENT_PROJECTION = {
+    "conversation_id": 1, "participants.user": 1, "updated_at": 1, "status": 1,
+    "summary": 1, "last_message": 1, "messages": {"$slice": -1}
+}
+
+# Keep the daily analytics rollups (rollups.py) up to date on every message write.
+# Off by default: it adds a rollups write to each message write (with WRITE_BEHIND,
+# one per flushed batch). Run backfill_rollups.py after turning it on.
+ROLLUPS = os.getenv('ROLLUPS', 'false').lower() == 'true'
+
+# Characters of message content kept by the streaming recent-message queries
+PREVIEW_LENGTH = int(os.getenv('MESSAGE_PREVIEW_LENGTH', '120'))
+
+# How long a per-user conversation count is reused before recounting
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', '60'))
+
+# Read-through cache in front of the conversation reads (CACHE_BACKEND, see cache.py).
+# List pages are namespaced by a per-user generation so one counter bump drops them all,
+# and each conversation by a version that every write replaces. Either way a read that
+# overlaps a write can only cache what it read under the name the write retired.
+cache = create_cache()
+
+def _conversation_key(conversation_id: str):
+    version = cache.peek(f"ver:{conversation_id}") or 0
+    return f"conv:{conversation_id}:{version}"
+
+def _list_key(user_id: str, *variant):
+    generation = cache.counter(f"gen:{user_id}")
+    return f"list:{user_id}:{generation}:" + ":".join(str(part) for part in variant)
+
+def invalidate_conversation(conversation_id: str = None, object_id=None, user_id: str = None):
+    """Drop cached copies of a conversation and of its owner's conversation lists"""
+    for key in (conversation_id, object_id):
+        if key:
+            cache.delete(_conversation_key(str(key)))
+            # A random version rather than a counter, so it expires along with the
+            # entries it names instead of being kept for every conversation ever written
+            cache.set(f"ver:{key}", uuid.uuid4().hex, ttl=2 * cache.ttl)
+    cache.incr(f"gen:{user_id}")
+    if user_id is not None:
+        cache.incr("gen:None")
+
+def clear_cache():
+    """Drop every cached conversation, list and count
+
+    With CACHE_BACKEND=redis this reaches every API process. The in-process cache
+    of a running API can't be cleared from a script: its entries expire within
+    CACHE_TTL, or restart the API.
+    """
+    cache.clear()
+    if cache.name == "memory":
+        print("Note: running API processes keep their in-process cache for up to CACHE_TTL "
+              "seconds; restart them to see the changes now")
+
+def ensure_indexes():
+    """Create the indexes the API queries rely on. Safe to call on every startup."""
+    # Sparse, because the Rasa tracker store shares this collection and its documents
+    # have no conversation_id
+    conversations.create_index("conversation_id", name="conversation_id", unique=True, sparse=True)
+    conversations.create_index(
+        [("participants.user.user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+        name="user_updated_at"
+    )
+    conversations.create_index([("updated_at", DESCENDING)], name="updated_at")
+    message_buckets.create_index(
+        [("conversation", ASCENDING), ("seq", ASCENDING)], name="conversation_seq", unique=True
+    )
+    message_buckets.create_index(
+        [("conversation", ASCENDING), ("messages.message_id", ASCENDING)], name="conversation_message_id"
+    )
+    message_buckets.create_index(
+        [("user_id", ASCENDING), ("last_timestamp", DESCENDING)], name="user_last_timestamp"
+    )
+    # Full-text search (search.py). The user ID prefix keeps each search inside one
+    # user's entries; such an index can only serve queries that match it exactly.
+    # Buckets get a text index. Embedded conversations don't: a text index
+    # re-tokenizes the whole messages array on every $push, which a bucket caps at
+    # BUCKET_SIZE but a conversation does not. Their messages are indexed one
+    # document each in message_terms instead (index_messages).
+    if "user_message_text" in conversations.index_information():
+        conversations.drop_index("user_message_text")
+    message_buckets.create_index(
+        [("user_id", ASCENDING), ("messages.content", TEXT)], name="user_message_text"
+    )
+    message_terms.create_index([("user_id", ASCENDING), ("terms", ASCENDING)], name="user_terms")
+    message_terms.create_index("conversation", name="conversation")
+    rollups.create_index([("user_id", ASCENDING), ("day", ASCENDING)], name="user_day")
 
 def store_conversation(user_id: str, username: str, display_name: str, message: str, 
                       platform: str = "web", language: str = "en-US", 
@@ -91,80 +242,673 @@ def store_conversation(user_id: str, username: str, display_name: str, message:
             conversation["summary"]["last_message_id"] = response_id
             conversation["summary"]["last_message_timestamp"] = datetime.utcnow()
         
-        result = conversations.insert_one(conversation)
+        with timed("mongo_write"):
+            if MESSAGE_STORAGE == "bucketed":
+                result = _insert_bucketed(conversation)
+            else:
+                result = conversations.insert_one(conversation)
+        if MESSAGE_STORAGE != "bucketed":
+            index_messages(result.inserted_id, user_id, conversation["messages"])
         conversation['_id'] = str(result.inserted_id)  # Convert ObjectId to string
+        invalidate_conversation(user_id=user_id)
+        record_rollups(rollup_increments(user_id, conversation["messages"]))
         return conversation
     except Exception as e:
         print(f"Error storing conversation: {e}")
         raise e
 
+def conversation_query(conversation_id: str):
+    """Build the single indexed filter for a conversation ID
+
+    The API hands out both ObjectId strings (`_id`) and UUID `conversation_id`s;
+    the two formats never overlap, so the ID itself says which field to match.
+    Rasa tracker documents share the collection but have no conversation_id, so
+    an `_id` match must not select them.
+    """
+    if ObjectId.is_valid(conversation_id):
+        return {"_id": ObjectId(conversation_id), "conversation_id": {"$exists": True}}
+    return {"conversation_id": conversation_id}
+
+def conversation_object_id(conversation_id: str):
+    """Return the ObjectId string of a conversation from either of its IDs (None if there is none)"""
+    try:
+        with timed("mongo_read"):
+            conversation = conversations.find_one(conversation_query(conversation_id), {"_id": 1})
+        return str(conversation["_id"]) if conversation else None
+    except Exception as e:
+        print(f"Error resolving conversation ID: {e}")
+        raise e
+
 def get_single_conversation(conversation_id: str):
     """Retrieve a single conversation by ID"""
     try:
-        # Try to find by conversation_id first
-        conversation = conversations.find_one({"conversation_id": conversation_id})
-        if not conversation:
-            # If not found, try to find by _id (in case conversation_id is actually an ObjectId)
-            try:
-                conversation = conversations.find_one({"_id": ObjectId(conversation_id)})
-            except:
-                pass
+        key = _conversation_key(conversation_id)
+        conversation = cache.get(key)
+        if conversation is not None:
+            return conversation
+        
+        with timed("mongo_read"):
+            conversation = conversations.find_one(conversation_query(conversation_id))
+            if conversation and conversation.get("storage") == "bucketed":
+                conversation["messages"] = [
+                    message for bucket in message_buckets.find({"conversation": conversation["_id"]}).sort("seq", ASCENDING)
+                    for message in bucket["messages"]
+                ]
+        if conversation:
+            cache.set(key, conversation)
         return conversation
     except Exception as e:
         print(f"Error retrieving conversation: {e}")
         raise e
 
-def get_conversations(user_id: str = None, page: int = 1, per_page: int = 20):
-    """Retrieve paginated conversations from MongoDB"""
+def get_conversation_window(conversation_id: str, since_message_id: str = None, since: datetime = None,
+                            before: str = None, limit: int = None):
+    """Retrieve a conversation with only a window of its messages
+
+    since_message_id / since return only messages newer than that message or time,
+    before returns only messages older than that message id. limit keeps the oldest
+    messages of a since-query and the newest messages otherwise. The document also
+    carries `has_older`, telling whether messages exist before the returned window.
+    """
     try:
+        query = conversation_query(conversation_id)
+
+        # Each stage narrows the _window array, leaving the stored messages untouched
+        stages = [{"$match": query}, {"$addFields": {"_window": {"$ifNull": ["$messages", []]}}}]
+        if before:
+            index = {"$indexOfArray": ["$_window.message_id", before]}
+            stages.append({"$addFields": {"_window": {"$switch": {
+                "branches": [
+                    {"case": {"$lt": [index, 0]}, "then": "$_window"},
+                    {"case": {"$eq": [index, 0]}, "then": []}
+                ],
+                "default": {"$slice": ["$_window", index]}
+            }}}})
+        if since_message_id:
+            index = {"$indexOfArray": ["$_window.message_id", since_message_id]}
+            stages.append({"$addFields": {"_window": {
+                "$slice": ["$_window", {"$add": [index, 1]}, {"$max": [{"$size": "$_window"}, 1]}]
+            }}})
+        if since:
+            stages.append({"$addFields": {"_window": {
+                "$filter": {"input": "$_window", "as": "m", "cond": {"$gt": ["$$m.timestamp", since]}}
+            }}})
+        if limit:
+            n = limit if (since_message_id or since) else -limit
+            stages.append({"$addFields": {"_window": {"$slice": ["$_window", n]}}})
+        stages.append({"$addFields": {
+            "messages": "$_window",
+            "has_older": {"$cond": [
+                {"$eq": [{"$size": "$_window"}, 0]},
+                False,
+                {"$gt": [
+                    {"$indexOfArray": [
+                        {"$ifNull": ["$messages.message_id", []]},
+                        {"$arrayElemAt": ["$_window.message_id", 0]}
+                    ]},
+                    0
+                ]}
+            ]}
+        }})
+        stages.append({"$project": {"_window": 0}})
+
+        with timed("mongo_read"):
+            results = list(conversations.aggregate(stages))
+            if results and results[0].get("storage") == "bucketed":
+                # Bucketed headers have no messages array, so the pipeline only fetched the header
+                return _get_bucketed_window(results[0], since_message_id, since, before, limit)
+        return results[0] if results else None
+    except Exception as e:
+        print(f"Error retrieving conversation window: {e}")
+        raise e
+
+def get_conversations(user_id: str = None, page: int = 1, per_page: int = 20, list_view: bool = False):
+    """Retrieve paginated conversations from MongoDB
+
+    With list_view=True each conversation only carries its last message.
+    """
+    try:
+        key = _list_key(user_id, "page", page, per_page, list_view)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        
         query = {}
         if user_id:
             query["participants.user.user_id"] = user_id
         
         # Get total count for pagination
-        total = conversations.count_documents(query)
+        total = count_conversations(user_id)
         
         # Calculate skip and limit
         skip = (page - 1) * per_page
         limit = per_page
         
         # Get paginated results
-        cursor = conversations.find(query).sort("updated_at", -1).skip(skip).limit(limit)
-        results = list(cursor)
+        projection = LIST_PROJECTION if list_view else None
+        cursor = (
+            conversations.find(query, projection)
+            .sort([("updated_at", DESCENDING), ("_id", DESCENDING)])
+            .skip(skip)
+            .limit(limit)
+        )
+        with timed("mongo_read"):
+            results = list(cursor)
         
+        cache.set(key, (results, total))
         return results, total
     except Exception as e:
         print(f"Error retrieving conversations: {e}")
         raise e
 
-def add_message_to_conversation(conversation_id: str, sender: str, content: str, metadata: dict = None):
-    """Add a new message to an existing conversation"""
+def count_conversations(user_id: str = None):
+    """Count a user's conversations, reusing a recent count for COUNT_CACHE_TTL seconds
+
+    The count is cached under the user's list generation, so a new conversation
+    drops it in every process that shares the cache.
+    """
+    key = _list_key(user_id, "count")
+    total = cache.get(key)
+    if total is not None:
+        return total
+    query = {"participants.user.user_id": user_id} if user_id else {}
+    with timed("mongo_read"):
+        total = conversations.count_documents(query)
+    cache.set(key, total, COUNT_CACHE_TTL)
+    return total
+
+def encode_cursor(conversation: dict):
+    """Build an opaque keyset cursor pointing just after this conversation"""
+    payload = {"u": conversation["updated_at"].isoformat(), "i": str(conversation["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Raises ValueError for a malformed cursor."""
     try:
-        message_id = f"msg-{str(uuid.uuid4())[:8]}"
-        message = {
-            "message_id": message_id,
-            "sender": sender,
-            "content": content,
-            "timestamp": datetime.utcnow(),
-            "status": "delivered",
-            "metadata": metadata or {}
-        }
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["u"]), ObjectId(payload["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_conversations_after(user_id: str = None, cursor: str = None, per_page: int = 20, list_view: bool = False):
+    """Retrieve a page of conversations using keyset pagination on (updated_at, _id)
+
+    Returns the conversations and the cursor for the next page (None on the last page).
+    """
+    try:
+        key = _list_key(user_id, "after", cursor or "", per_page, list_view)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        query = {}
+        if user_id:
+            query["participants.user.user_id"] = user_id
+        if cursor:
+            updated_at, last_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": last_id}}
+            ]
+
+        # Fetch one extra document to know whether another page exists
+        projection = LIST_PROJECTION if list_view else None
+        with timed("mongo_read"):
+            results = list(
+                conversations.find(query, projection)
+                .sort([("updated_at", DESCENDING), ("_id", DESCENDING)])
+                .limit(per_page + 1)
+            )
+        next_cursor = None
+        if len(results) > per_page:
+            results = results[:per_page]
+            next_cursor = encode_cursor(results[-1])
+
+        cache.set(key, (results, next_cursor))
+        return results, next_cursor
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Error retrieving conversations: {e}")
+        raise e
+
+def _recent_activity_cursor(since: datetime, limit: int = None, batch_size: int = None):
+    cursor = (
+        conversations.find({"updated_at": {"$gte": since}}, RECENT_PROJECTION)
+        .sort("updated_at", DESCENDING)
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    return cursor
+
+def get_recent_activity(since: datetime, limit: int = 10):
+    """Retrieve the conversations updated since a cutoff, most recent first
+
+    The cutoff, limit and RECENT_PROJECTION are all applied by MongoDB, using the
+    updated_at index.
+    """
+    try:
+        with timed("mongo_read"):
+            return list(_recent_activity_cursor(since, limit))
+    except Exception as e:
+        print(f"Error retrieving recent activity: {e}")
+        raise e
+
+def iter_recent_activity(since: datetime, batch_size: int = 500):
+    """Generator version of get_recent_activity with no limit
+
+    Documents are fetched from the server `batch_size` at a time, so only one batch
+    is held in memory however many conversations match.
+    """
+    try:
+        yield from _recent_activity_cursor(since, batch_size=batch_size)
+    except Exception as e:
+        print(f"Error streaming recent activity: {e}")
+        raise e
+
+def _recent_message_stages(since: datetime = None):
+    """Unwind, filter, sort and trim messages; shared by both storage layouts"""
+    stages = [{"$unwind": "$messages"}]
+    if since:
+        stages.append({"$match": {"messages.timestamp": {"$gte": since}}})
+    stages += [
+        {"$sort": {"messages.timestamp": DESCENDING}},
+        {"$project": {
+            "_id": 0,
+            "conversation": 1,
+            "message_id": "$messages.message_id",
+            "sender": "$messages.sender",
+            "timestamp": "$messages.timestamp",
+            "preview": {"$substrCP": [{"$ifNull": ["$messages.content", ""]}, 0, PREVIEW_LENGTH]}
+        }}
+    ]
+    return stages
+
+def iter_recent_messages(user_id: str = None, since: datetime = None):
+    """Stream a user's messages newest first, without loading them all
+
+    Each item carries the conversation ID, message_id, sender, timestamp and a
+    PREVIEW_LENGTH-character preview of the content. Messages from embedded and
+    bucketed conversations are merged into one stream; stop iterating to stop reading.
+    """
+    try:
+        query = {"messages.0": {"$exists": True}}
+        bucket_query = {}
+        if user_id:
+            query["participants.user.user_id"] = user_id
+            bucket_query["user_id"] = user_id
+        if since:
+            query["updated_at"] = {"$gte": since}
+            bucket_query["last_timestamp"] = {"$gte": since}
+
+        embedded = conversations.aggregate(
+            [{"$match": query}, {"$addFields": {"conversation": "$conversation_id"}}]
+            + _recent_message_stages(since),
+            allowDiskUse=True
+        )
+        bucketed = message_buckets.aggregate(
+            [{"$match": bucket_query}, {"$addFields": {"conversation": {"$toString": "$conversation"}}}]
+            + _recent_message_stages(since),
+            allowDiskUse=True
+        )
+        yield from heapq.merge(embedded, bucketed, key=lambda message: message["timestamp"], reverse=True)
+    except Exception as e:
+        print(f"Error streaming recent messages: {e}")
+        raise e
+
+def build_message(sender: str, content: str, metadata: dict = None):
+    """Create a message document ready to be appended to a conversation"""
+    return {
+        "message_id": f"msg-{str(uuid.uuid4())[:8]}",
+        "sender": sender,
+        "content": content,
+        "timestamp": datetime.utcnow(),
+        "status": "delivered",
+        "metadata": metadata or {}
+    }
+
+def add_messages_to_conversation(conversation_id: str, messages: list):
+    """Append several messages (from build_message) to a conversation
+
+    Embedded conversations take a single write; bucketed ones a header update plus
+    one write per bucket touched (normally one).
+    """
+    if not messages:
+        return True
+    try:
+        # Try the configured layout first; the other one only costs a miss
+        layouts = [_append_embedded, _append_bucketed]
+        if MESSAGE_STORAGE == "bucketed":
+            layouts.reverse()
+        with timed("mongo_write"):
+            for append in layouts:
+                updated = append(conversation_id, messages)
+                if updated is not None:
+                    break
+            else:
+                return False
         
-        # Update the conversation
-        result = conversations.update_one(
-            {"conversation_id": conversation_id},
+        user_id = updated.get("participants", {}).get("user", {}).get("user_id")
+        if append is _append_embedded:
+            index_messages(updated["_id"], user_id, messages)
+        invalidate_conversation(updated.get("conversation_id"), updated["_id"], user_id)
+        record_rollups(rollup_increments(user_id, messages))
+        return True
+    except Exception as e:
+        print(f"Error adding messages to conversation: {e}")
+        raise e
+
+def add_messages_bulk(batches: list):
+    """Append messages to many conversations with one bulk_write
+
+    `batches` is a list of (conversation_id, messages) pairs; a conversation should
+    appear at most once so its messages keep their order. Bucketed conversations are
+    appended one by one. Messages whose message_id is already stored are skipped, so
+    a batch can be retried or replayed after a partial failure without duplicating
+    anything (embedded messages still count towards the rollups again, but are
+    indexed for search only once).
+    Returns the conversation IDs that were not found.
+    """
+    if not batches:
+        return []
+    try:
+        with timed("mongo_read"):
+            headers = list(conversations.find(
+                {"$or": [conversation_query(conversation_id) for conversation_id, _ in batches]},
+                {"conversation_id": 1, "storage": 1, "participants.user.user_id": 1}
+            ))
+        by_id = {}
+        for header in headers:
+            by_id[str(header["_id"])] = header
+            if header.get("conversation_id"):
+                by_id[header["conversation_id"]] = header
+
+        operations = []
+        missing = []
+        totals = {}
+        embedded = []
+        with timed("mongo_write"):
+            for conversation_id, messages in batches:
+                header = by_id.get(conversation_id)
+                if header is None:
+                    missing.append(conversation_id)
+                    continue
+                user_id = header.get("participants", {}).get("user", {}).get("user_id")
+                if header.get("storage") == "bucketed":
+                    messages = _unstored_bucketed(header["_id"], messages)
+                    if messages:
+                        _append_bucketed(conversation_id, messages)
+                    rollup_increments(user_id, messages, totals)
+                    continue
+                rollup_increments(user_id, messages, totals)
+                embedded.append((header["_id"], user_id, messages))
+                # One guarded push per message: a message that is already stored
+                # matches nothing, and ordered execution keeps the conversation's order
+                for message in messages:
+                    operations.append(UpdateOne(
+                        {"_id": header["_id"], "messages.message_id": {"$ne": message["message_id"]}},
+                        {
+                            "$push": {"messages": message},
+                            "$inc": {"summary.total_messages": 1},
+                            "$set": _summary_update([message])
+                        }
+                    ))
+            if operations:
+                conversations.bulk_write(operations, ordered=True)
+        record_rollups(totals)
+        for header_id, user_id, messages in embedded:
+            index_messages(header_id, user_id, messages)
+
+        for header in headers:
+            user_id = header.get("participants", {}).get("user", {}).get("user_id")
+            invalidate_conversation(header.get("conversation_id"), header["_id"], user_id)
+        return missing
+    except Exception as e:
+        print(f"Error adding messages in bulk: {e}")
+        raise e
+
+def _unstored_bucketed(header_id, messages: list):
+    """Drop the messages a bucketed conversation already holds"""
+    ids = [message["message_id"] for message in messages]
+    stored = set()
+    for bucket in message_buckets.find({"conversation": header_id, "messages.message_id": {"$in": ids}},
+                                       {"messages.message_id": 1}):
+        stored.update(message["message_id"] for message in bucket["messages"])
+    return [message for message in messages if message["message_id"] not in stored]
+
+def search_entries(header_id, user_id: str, messages: list):
+    """message_terms documents for an embedded conversation's messages (those with any term)"""
+    entries = []
+    for message in messages:
+        words = terms(message.get("content"))
+        if words:
+            entries.append({
+                "_id": f"{header_id}|{message['message_id']}",
+                "user_id": user_id,
+                "conversation": header_id,
+                "message_id": message["message_id"],
+                "sender": message.get("sender"),
+                "timestamp": message.get("timestamp"),
+                "content": message.get("content"),
+                "terms": words
+            })
+    return entries
+
+def index_messages(header_id, user_id: str, messages: list):
+    """Add an embedded conversation's messages to the search index
+
+    Entries are keyed by message, so indexing a message again changes nothing.
+    Search must never fail a message write, so errors are only reported;
+    backfill_search.py rebuilds the index.
+    """
+    try:
+        operations = [
+            UpdateOne({"_id": entry.pop("_id")}, {"$setOnInsert": entry}, upsert=True)
+            for entry in search_entries(header_id, user_id, messages)
+        ]
+        if operations:
+            with timed("mongo_write"):
+                message_terms.bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"Error indexing messages for search: {e}")
+
+def write_rollups(totals: dict):
+    """Apply rollup counters (from rollups.rollup_increments) with one bulk_write, raising on error"""
+    if not totals:
+        return
+    operations = [
+        UpdateOne(
+            {"_id": rollup_key},
+            {"$inc": entry["inc"], "$setOnInsert": {"user_id": entry["user_id"], "day": entry["day"]}},
+            upsert=True
+        )
+        for rollup_key, entry in totals.items()
+    ]
+    with timed("mongo_write"):
+        rollups.bulk_write(operations, ordered=False)
+
+def record_rollups(totals: dict):
+    """Apply rollup counters from the message write path, when ROLLUPS is on
+
+    Analytics must never fail a message write, so errors are only reported.
+    """
+    if not ROLLUPS:
+        return
+    try:
+        write_rollups(totals)
+    except Exception as e:
+        print(f"Error recording rollups: {e}")
+
+def get_rollups(user_id: str = None, since: datetime = None, until: datetime = None):
+    """Retrieve daily rollups for a user (or for all users), oldest day first"""
+    try:
+        query = {"user_id": user_id or ALL_USERS}
+        if since or until:
+            query["day"] = {}
+            if since:
+                query["day"]["$gte"] = since
+            if until:
+                query["day"]["$lt"] = until
+        with timed("mongo_read"):
+            return list(rollups.find(query).sort("day", ASCENDING))
+    except Exception as e:
+        print(f"Error retrieving rollups: {e}")
+        raise e
+
+def _summary_update(messages: list):
+    last_message = messages[-1]
+    return {
+        "updated_at": datetime.utcnow(),
+        "summary.last_message_id": last_message["message_id"],
+        "summary.last_message_timestamp": last_message["timestamp"]
+    }
+
+def _append_embedded(conversation_id: str, messages: list):
+    # $inc keeps the counter exact when several writers hit the same conversation
+    return conversations.find_one_and_update(
+        {**conversation_query(conversation_id), "storage": {"$ne": "bucketed"}},
+        {
+            "$push": {"messages": {"$each": messages}},
+            "$inc": {"summary.total_messages": len(messages)},
+            "$set": _summary_update(messages)
+        },
+        projection={"conversation_id": 1, "participants.user.user_id": 1}
+    )
+
+def _append_bucketed(conversation_id: str, messages: list):
+    # Bumping the header counter first reserves message positions atomically, so
+    # concurrent writers agree on which bucket every message belongs to
+    header = conversations.find_one_and_update(
+        {**conversation_query(conversation_id), "storage": "bucketed"},
+        {
+            "$inc": {"summary.total_messages": len(messages)},
+            "$set": {**_summary_update(messages), "last_message": messages[-1]}
+        },
+        projection={"conversation_id": 1, "participants.user.user_id": 1, "summary.total_messages": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if header is None:
+        return None
+    user_id = header.get("participants", {}).get("user", {}).get("user_id")
+    _push_to_buckets(header["_id"], user_id, messages, header["summary"]["total_messages"] - len(messages))
+    return header
+
+def _push_to_buckets(header_id, user_id: str, messages: list, first_position: int):
+    """Append messages to the buckets that own positions first_position onwards"""
+    by_seq = {}
+    for offset, message in enumerate(messages):
+        by_seq.setdefault((first_position + offset) // BUCKET_SIZE, []).append(message)
+    for seq, bucket_messages in by_seq.items():
+        update = {
+            "$push": {"messages": {"$each": bucket_messages}},
+            "$inc": {"count": len(bucket_messages)},
+            "$max": {"last_timestamp": bucket_messages[-1]["timestamp"]},
+            "$min": {"first_timestamp": bucket_messages[0]["timestamp"]},
+            "$setOnInsert": {"user_id": user_id}
+        }
+        try:
+            message_buckets.update_one({"conversation": header_id, "seq": seq}, update, upsert=True)
+        except DuplicateKeyError:
+            # Another writer created the bucket between our match and insert
+            message_buckets.update_one({"conversation": header_id, "seq": seq}, update)
+
+def _insert_bucketed(conversation: dict):
+    """Insert a new conversation (in embedded shape) using the bucketed layout"""
+    messages = conversation.pop("messages")
+    conversation["storage"] = "bucketed"
+    conversation["last_message"] = messages[-1]
+    result = conversations.insert_one(conversation)
+    user_id = conversation["participants"]["user"]["user_id"]
+    _push_to_buckets(result.inserted_id, user_id, messages, 0)
+    conversation["messages"] = messages
+    return result
+
+def _slice_window(messages: list, since_message_id: str = None, since: datetime = None,
+                  before: str = None, limit: int = None):
+    """Python twin of the get_conversation_window pipeline
+
+    Returns the window and the index of its first message in `messages`.
+    """
+    ids = [message["message_id"] for message in messages]
+    start, end = 0, len(messages)
+    if before and before in ids:
+        end = ids.index(before)
+    if since_message_id and since_message_id in ids[:end]:
+        start = ids.index(since_message_id, 0, end) + 1
+    window = list(enumerate(messages))[start:end]
+    if since:
+        window = [(i, message) for i, message in window if message["timestamp"] > since]
+    if limit:
+        window = window[:limit] if (since_message_id or since) else window[-limit:]
+    return [message for _, message in window], (window[0][0] if window else None)
+
+def _bucket_seq(header_id, message_id: str):
+    bucket = message_buckets.find_one({"conversation": header_id, "messages.message_id": message_id}, {"seq": 1})
+    return bucket["seq"] if bucket else None
+
+def _get_bucketed_window(conversation: dict, since_message_id: str = None, since: datetime = None,
+                         before: str = None, limit: int = None):
+    """get_conversation_window for the bucketed layout: only loads the buckets it needs"""
+    header_id = conversation["_id"]
+    bucket_query = {"conversation": header_id}
+    seq_range = {}
+    before_seq = _bucket_seq(header_id, before) if before else None
+    if before_seq is not None:
+        seq_range["$lte"] = before_seq
+    since_seq = _bucket_seq(header_id, since_message_id) if since_message_id else None
+    if since_seq is not None:
+        seq_range["$gte"] = since_seq
+    if seq_range:
+        bucket_query["seq"] = seq_range
+    if since:
+        bucket_query["last_timestamp"] = {"$gt": since}
+
+    # Read forwards for delta queries and backwards for "latest N" queries, stopping
+    # once enough messages are loaded (one spare bucket covers the before/since trim)
+    forwards = bool(since_message_id or since)
+    buckets = []
+    loaded = 0
+    cursor = message_buckets.find(bucket_query).sort("seq", ASCENDING if forwards else DESCENDING)
+    for bucket in cursor:
+        buckets.append(bucket)
+        loaded += len(bucket["messages"])
+        if limit and loaded >= limit + BUCKET_SIZE:
+            break
+    if not forwards:
+        buckets.reverse()
+
+    messages = [message for bucket in buckets for message in bucket["messages"]]
+    window, start = _slice_window(messages, since_message_id, since, before, limit)
+
+    conversation["messages"] = window
+    conversation["has_older"] = bool(window) and (start > 0 or buckets[0]["seq"] > 0)
+    return conversation
+
+def repair_summary_counters():
+    """Recompute summary.total_messages wherever an older write stored a non-numeric value
+
+    $inc fails on such a counter, so this must run before those conversations take
+    new messages (api.migrate runs it at startup). Returns the number fixed.
+    """
+    try:
+        # conversation_id excludes the Rasa tracker documents sharing the collection
+        result = conversations.update_many(
             {
-                "$push": {"messages": message},
-                "$set": {
-                    "updated_at": datetime.utcnow(),
-                    "summary.total_messages": {"$add": ["$summary.total_messages", 1]},
-                    "summary.last_message_id": message_id,
-                    "summary.last_message_timestamp": datetime.utcnow()
-                }
-            }
+                "conversation_id": {"$exists": True},
+                "summary.total_messages": {"$not": {"$type": "number"}},
+                "storage": {"$ne": "bucketed"}
+            },
+            [{"$set": {"summary.total_messages": {"$size": {"$ifNull": ["$messages", []]}}}}]
         )
-        
-        return result.modified_count > 0
+        if result.modified_count:
+            cache.clear()
+        return result.modified_count
     except Exception as e:
-        print(f"Error adding message to conversation: {e}")
-        raise e 
\ No newline at end of file
+        print(f"Error repairing summary counters: {e}")
+        raise e
+
+def add_message_to_conversation(conversation_id: str, sender: str, content: str, metadata: dict = None):
+    """Add a new message to an existing conversation"""
+    return add_messages_to_conversation(conversation_id, [build_message(sender, content, metadata)])
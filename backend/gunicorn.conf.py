@@ -0,0 +1,74 @@
+"""Production server settings.
+
+    gunicorn -c gunicorn.conf.py api:app
+
+Every setting can be overridden from the environment (or .env). The defaults run
+one gthread worker per CPU: the API mostly waits on Rasa and MongoDB, so threads
+keep a worker busy while a single process per core avoids GIL contention.
+
+Socket.IO: with more than one worker, set SOCKETIO_MESSAGE_QUEUE to a Redis URL so
+events published by one worker reach clients connected to another, and have
+clients use the websocket transport (long-polling needs sticky sessions).
+WRITE_BEHIND_LOG names one file per process, so leave it unset with several workers.
+
+Caches: a worker only invalidates its own in-process cache, so with more than one
+worker the conversation cache must be shared (CACHE_BACKEND=redis); the memory
+backend is switched off rather than left serving stale conversations.
+
+Metrics: every worker keeps its own counters, and /metrics reports those of the
+worker that answered the scrape. Scrape with one worker (WEB_CONCURRENCY=1 and
+more GUNICORN_THREADS) when exact totals matter; with several, treat the series
+as a sample of the workers.
+"""
+import multiprocessing
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Loaded here, before the app is imported, so module-level settings see .env
+load_dotenv()
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+if workers > 1 and os.getenv('CACHE_BACKEND', 'memory') == 'memory':
+    print("CACHE_BACKEND=memory can't be shared between workers; disabling the cache "
+          "(set CACHE_BACKEND=redis to keep it)", file=sys.stderr)
+    os.environ['CACHE_BACKEND'] = 'none'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Rasa calls are bounded by RASA_READ_TIMEOUT and retries; leave room above them
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+# Importing the app opens no connections, so it is safe to load once in the
+# master and share the imported code with every forked worker
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def on_starting(server):
+    # Runs once in the master. Its MongoDB client is closed again before any
+    # worker is forked, so no connection is shared with them
+    from api import migrate
+    from database import close_client
+
+    migrate()
+    close_client()
+
+
+def post_worker_init(worker):
+    from api import init_worker
+
+    init_worker()
+
+
+def worker_exit(server, worker):
+    # Runs after the worker stops accepting requests and finishes in-flight ones
+    # (up to graceful_timeout), so queued writes are flushed before it exits
+    from api import shutdown
+
+    shutdown()
@@ -0,0 +1,122 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to the Rasa timeout
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Fraction of requests to run under cProfile (0 disables profiling)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(snapshot.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines)
+
+
+REQUEST_DURATION = Histogram(
+    "chatbot_request_duration_seconds", "Time spent serving each API route", ("route", "method", "status")
+)
+STAGE_DURATION = Histogram(
+    "chatbot_stage_duration_seconds", "Time spent in each hot-path stage", ("stage",)
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of a block, e.g. `with timed("mongo_read"): ...`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage)
+
+
+def render_metrics(extra: dict = None):
+    """Render every metric in the Prometheus text exposition format
+
+    `extra` maps metric names to plain numbers (exported as gauges). The values
+    are this process's own: each server worker reports only its share.
+    """
+    parts = [REQUEST_DURATION.render(), STAGE_DURATION.render()]
+    for name, value in sorted((extra or {}).items()):
+        parts.append(f"# TYPE {name} gauge\n{name} {value}")
+    return "\n".join(parts) + "\n"
+
+
+def init_app(app):
+    """Time every request and, for a sampled fraction, profile it"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _report_profile(profiler, request.path)
+        return response
+
+
+def _report_profile(profiler, path: str):
+    if PROFILE_DIR:
+        filename = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{path.strip('/').replace('/', '_') or 'index'}.prof")
+        profiler.dump_stats(filename)
+        logger.info("Saved request profile path=%s file=%s", path, filename)
+        return
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+    logger.info("Request profile path=%s\n%s", path, stream.getvalue())
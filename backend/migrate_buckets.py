@@ -0,0 +1,132 @@
+"""Convert conversations between the embedded and bucketed message layouts.
+
+    python migrate_buckets.py --to bucketed [--user-id USER] [--limit N] [--dry-run]
+    python migrate_buckets.py --to embedded
+
+Each conversation is converted on its own. The header is only switched over if
+its message count didn't change while its buckets were written, so conversations
+that receive messages mid-migration are skipped and picked up on the next run.
+Bucketed conversations are searched through their buckets, so their entries in
+the embedded layout's search index are dropped and re-added on the way back.
+"""
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+# Before database.py reads MESSAGE_BUCKET_SIZE and friends
+load_dotenv()
+
+from database import (BUCKET_SIZE, conversations, message_buckets, message_terms, ensure_indexes, clear_cache,
+                      index_messages)
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+
+def to_bucketed(conversation: dict, dry_run: bool = False):
+    messages = conversation.get("messages", [])
+    user_id = conversation.get("participants", {}).get("user", {}).get("user_id")
+    buckets = [
+        {
+            "conversation": conversation["_id"],
+            "seq": seq,
+            "user_id": user_id,
+            "count": len(chunk),
+            "messages": chunk,
+            "first_timestamp": chunk[0].get("timestamp"),
+            "last_timestamp": chunk[-1].get("timestamp"),
+        }
+        for seq, chunk in enumerate(
+            messages[start:start + BUCKET_SIZE] for start in range(0, len(messages), BUCKET_SIZE)
+        )
+    ]
+    if dry_run:
+        return True
+
+    message_buckets.delete_many({"conversation": conversation["_id"]})
+    if buckets:
+        message_buckets.insert_many(buckets, ordered=True)
+    result = conversations.update_one(
+        {"_id": conversation["_id"], "messages": {"$size": len(messages)}},
+        {
+            "$set": {
+                "storage": "bucketed",
+                "last_message": messages[-1] if messages else None,
+                "summary.total_messages": len(messages),
+            },
+            "$unset": {"messages": ""},
+        },
+    )
+    if result.modified_count == 0:
+        # A message arrived while we were copying; leave the embedded document in charge
+        message_buckets.delete_many({"conversation": conversation["_id"]})
+        return False
+    message_terms.delete_many({"conversation": conversation["_id"]})
+    return True
+
+
+def to_embedded(conversation: dict, dry_run: bool = False):
+    buckets = list(message_buckets.find({"conversation": conversation["_id"]}).sort("seq", ASCENDING))
+    messages = [message for bucket in buckets for message in bucket["messages"]]
+    if dry_run:
+        return True
+
+    total = conversation.get("summary", {}).get("total_messages", len(messages))
+    if total != len(messages):
+        # A writer has reserved a position but not filled its bucket yet
+        return False
+    result = conversations.update_one(
+        {"_id": conversation["_id"], "storage": "bucketed", "summary.total_messages": total},
+        {
+            "$set": {"messages": messages, "summary.total_messages": len(messages)},
+            "$unset": {"storage": "", "last_message": ""},
+        },
+    )
+    if result.modified_count == 0:
+        return False
+    message_buckets.delete_many({"conversation": conversation["_id"]})
+    index_messages(conversation["_id"], conversation.get("participants", {}).get("user", {}).get("user_id"), messages)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--to', choices=['bucketed', 'embedded'], default='bucketed')
+    parser.add_argument('--user-id', help='Only convert this user\'s conversations')
+    parser.add_argument('--limit', type=int, default=0, help='Stop after this many conversations')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ensure_indexes()
+    query = {"conversation_id": {"$exists": True}}
+    if args.to == "bucketed":
+        query["storage"] = {"$ne": "bucketed"}
+        convert = to_bucketed
+    else:
+        query["storage"] = "bucketed"
+        convert = to_embedded
+    if args.user_id:
+        query["participants.user.user_id"] = args.user_id
+
+    converted = skipped = 0
+    cursor = conversations.find(query, no_cursor_timeout=True, batch_size=50)
+    try:
+        for conversation in cursor:
+            if convert(conversation, args.dry_run):
+                converted += 1
+            else:
+                skipped += 1
+                logger.warning("Skipped %s: it changed during migration", conversation["_id"])
+            if args.limit and converted + skipped >= args.limit:
+                break
+    finally:
+        cursor.close()
+
+    clear_cache()
+    logger.info("Converted %d conversations to %s, skipped %d", converted, args.to, skipped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RASA_URL = os.getenv('RASA_URL', 'http://localhost:5005')  # Default Rasa server URL
+WEBHOOK_PATH = "/webhooks/rest/webhook"
+# Comma-separated pool of Rasa servers; defaults to the single RASA_URL
+RASA_URLS = [url.strip() for url in os.getenv('RASA_URLS', RASA_URL).split(',') if url.strip()]
+
+# Connection pool and timeout settings
+POOL_CONNECTIONS = int(os.getenv('RASA_POOL_CONNECTIONS', '4'))
+POOL_MAXSIZE = int(os.getenv('RASA_POOL_MAXSIZE', '32'))
+CONNECT_TIMEOUT = float(os.getenv('RASA_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.getenv('RASA_READ_TIMEOUT', '10'))
+RETRIES = int(os.getenv('RASA_RETRIES', '2'))
+BACKOFF = float(os.getenv('RASA_BACKOFF', '0.2'))
+
+# Upstream protection: at most MAX_CONCURRENCY calls in flight, at most MAX_QUEUE
+# callers waiting for a slot, and a circuit breaker that fails fast while Rasa is down
+MAX_CONCURRENCY = int(os.getenv('RASA_MAX_CONCURRENCY', '16'))
+MAX_QUEUE = int(os.getenv('RASA_MAX_QUEUE', '32'))
+QUEUE_TIMEOUT = float(os.getenv('RASA_QUEUE_TIMEOUT', '2'))
+# Share one Rasa call between identical turns (same sender and text) that overlap,
+# e.g. a double-submitted message, instead of sending the turn to Rasa twice
+COALESCE = os.getenv('RASA_COALESCE', 'true').lower() == 'true'
+BREAKER_FAILURES = int(os.getenv('RASA_BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.getenv('RASA_BREAKER_RESET', '15'))
+BREAKER_PROBES = int(os.getenv('RASA_BREAKER_PROBES', '1'))
+
+# Pool routing: how often nodes are health-checked, and how far above the pool's
+# average in-flight count a sender's home node may get before turns spill elsewhere
+HEALTH_INTERVAL = float(os.getenv('RASA_HEALTH_INTERVAL', '5'))
+LOAD_FACTOR = float(os.getenv('RASA_LOAD_FACTOR', '1.25'))
+
+# Only retry when Rasa can't have processed the message yet. Read timeouts are not
+# retried: the message may already be in the tracker and would be handled twice.
+RETRY_STATUSES = {502, 503, 504}
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    seconds up to `half_open_probes` calls are let through, and their outcome closes
+    or re-opens the circuit."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET,
+                 half_open_probes: int = BREAKER_PROBES):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probes = 0
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and self.probes < self.half_open_probes:
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def available(self):
+        """Whether allow() would currently let a call through, without taking a probe slot"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return self.probes < self.half_open_probes
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Rasa circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def cancel(self):
+        """Give back a half-open probe slot for a call that never reached Rasa"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.probes:
+                self.probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Rasa circuit opened failures=%d", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RasaOverloaded(Exception):
+    """Raised when too many callers are already waiting for a Rasa slot"""
+
+
+class ConcurrencyGate:
+    """Semaphore with a bound on how many callers may queue for it"""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+
+    def full(self):
+        return self.waiting >= self.max_queue
+
+    def __enter__(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                raise RasaOverloaded("Rasa request queue is full")
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            raise RasaOverloaded("Timed out waiting for a Rasa slot")
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+class RasaNode:
+    """One Rasa server in the pool, with its own circuit breaker and in-flight count"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.breaker = CircuitBreaker()
+        self.healthy = True
+        self.outstanding = 0
+
+    def available(self):
+        return self.healthy and self.breaker.available()
+
+    def rank(self, sender_id: str):
+        """Rendezvous-hash score of this node for a sender; the highest score is its home node"""
+        return hashlib.md5(f"{self.url}|{sender_id}".encode()).digest()
+
+
+class _Call:
+    """An in-flight send_message that identical turns wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class RasaClient:
+    """Blocking Rasa REST client backed by a keep-alive connection pool
+
+    With several servers in `base_urls`, each sender is routed to a home node picked
+    by rendezvous hashing, so every API worker sends a given conversation to the same
+    Rasa server without sharing any routing state. A turn only goes elsewhere when the
+    home node is down, its circuit is open, or it has more than `load_factor` times
+    its share of the calls in flight; it then goes to the least busy available node.
+    """
+
+    def __init__(self, base_urls=RASA_URLS, pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, retries: int = RETRIES, backoff: float = BACKOFF,
+                 health_interval: float = HEALTH_INTERVAL, load_factor: float = LOAD_FACTOR,
+                 coalesce: bool = COALESCE):
+        if isinstance(base_urls, str):
+            base_urls = [url.strip() for url in base_urls.split(',') if url.strip()]
+        self.nodes = [RasaNode(url) for url in base_urls]
+        self.base_url = self.nodes[0].url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.health_interval = health_interval
+        self.load_factor = load_factor
+        # requests keeps one connection pool per host, so each node gets its own
+        self.pool_connections = max(pool_connections, len(self.nodes))
+        self.pool_maxsize = pool_maxsize
+        self.gate = ConcurrencyGate()
+        self.coalesce = coalesce
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._health_thread = None
+        self._closed = threading.Event()
+
+    @property
+    def session(self):
+        """This process's pooled session, opened on first use
+
+        Pooled connections must not be shared across fork(), so a worker forked
+        from a process that already used the client opens its own pool.
+        """
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                          pool_maxsize=self.pool_maxsize, pool_block=False)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def overloaded(self):
+        """True when new turns should be turned away instead of queueing for Rasa"""
+        return self.gate.full()
+
+    def node_stats(self):
+        return [{
+            "url": node.url,
+            "healthy": node.healthy,
+            "outstanding": node.outstanding,
+            "circuit": node.breaker.state,
+            "circuit_rejected": node.breaker.rejected,
+        } for node in self.nodes]
+
+    def send_message(self, message: str, sender_id: str):
+        """Send a user message and return Rasa's list of responses, or None on failure
+
+        Returns None straight away while no node is available or the wait queue is full.
+        A turn identical to one already in flight waits for that call and gets its
+        reply, without taking a slot or reaching Rasa.
+        """
+        if not self.coalesce:
+            return self._send_message(message, sender_id)
+        key = (sender_id, message)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            return list(call.result) if call.result is not None else None
+        try:
+            call.result = self._send_message(message, sender_id)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _send_message(self, message: str, sender_id: str):
+        self._start_health_checks()
+        if not any(node.available() for node in self.nodes):
+            logger.warning("No Rasa node available, failing fast sender_id=%s", sender_id)
+            return None
+        try:
+            with self.gate:
+                return self._post_with_failover(message, sender_id)
+        except RasaOverloaded as e:
+            logger.warning("Rasa overloaded sender_id=%s error=%s", sender_id, e)
+            return None
+
+    def pick_node(self, sender_id: str, exclude=()):
+        """Return the node a sender's turn should go to, or None if none is available"""
+        candidates = sorted((node for node in self.nodes if node not in exclude and node.available()),
+                            key=lambda node: node.rank(sender_id), reverse=True)
+        if not candidates:
+            return None
+        home = candidates[0]
+        total = sum(node.outstanding for node in candidates)
+        if home.outstanding < math.ceil(self.load_factor * (total + 1) / len(candidates)):
+            return home
+        # min() keeps the first of equally busy nodes, i.e. the best-ranked one
+        return min(candidates, key=lambda node: node.outstanding)
+
+    def _post_with_failover(self, message: str, sender_id: str):
+        payload = {"sender": sender_id, "message": message}
+        tried, failed = [], set()
+        data = None
+        for attempt in range(self.retries + 1):
+            node = self.pick_node(sender_id, exclude=tried)
+            if node is None and tried:
+                # Every available node has failed once already; back off and retry them
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+                tried = []
+                node = self.pick_node(sender_id)
+            if node is None:
+                break
+            if not node.breaker.allow():
+                tried.append(node)
+                continue
+            try:
+                data, retryable = self._post(node, payload, attempt)
+            except Exception:
+                # The call never completed, so its half-open probe slot is handed back
+                node.breaker.cancel()
+                raise
+            if data is not None:
+                failed.discard(node)
+                node.breaker.record_success()
+                break
+            failed.add(node)
+            if not retryable:
+                break
+            tried.append(node)
+        # One failure per node per turn, however many attempts it took
+        for node in failed:
+            node.breaker.record_failure()
+        if data is None:
+            logger.error("Rasa did not return a response")
+        return data
+
+    def _post(self, node: RasaNode, payload: dict, attempt: int):
+        """POST to one node; returns (data, retryable)"""
+        with self._lock:
+            node.outstanding += 1
+        try:
+            response = self.session.post(f"{node.url}{WEBHOOK_PATH}", json=payload, timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            logger.warning("Rasa connection failed node=%s attempt=%d error=%s", node.url, attempt + 1, e)
+            # Out of rotation until the health check sees it answer again
+            if len(self.nodes) > 1:
+                node.healthy = False
+            return None, True
+        except requests.exceptions.RequestException as e:
+            logger.error("Request error when calling Rasa node=%s error=%s", node.url, e)
+            return None, False
+        finally:
+            with self._lock:
+                node.outstanding -= 1
+        if response.status_code == 200:
+            try:
+                return response.json(), False
+            except ValueError as e:
+                logger.error("Rasa returned invalid JSON node=%s error=%s", node.url, e)
+                return None, False
+        if response.status_code not in RETRY_STATUSES:
+            logger.error("Rasa returned status=%d node=%s", response.status_code, node.url)
+            return None, False
+        logger.warning("Rasa returned status=%d node=%s attempt=%d", response.status_code, node.url, attempt + 1)
+        return None, True
+
+    def check_health(self):
+        """Probe every node's root endpoint and update which ones are in rotation"""
+        for node in self.nodes:
+            try:
+                healthy = self.session.get(f"{node.url}/", timeout=self.timeout).status_code == 200
+            except requests.exceptions.RequestException:
+                healthy = False
+            if healthy != node.healthy:
+                logger.warning("Rasa node %s node=%s", "recovered" if healthy else "unhealthy", node.url)
+            node.healthy = healthy
+
+    def _start_health_checks(self):
+        # A single node is only guarded by its circuit breaker; there is nowhere to fail
+        # over to. Threads don't survive fork(), so a forked worker starts its own checker.
+        if len(self.nodes) == 1 or (self._health_thread is not None and self._health_thread.is_alive()):
+            return
+        with self._lock:
+            if self._health_thread is not None and self._health_thread.is_alive():
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name='rasa-health', daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._closed.wait(self.health_interval):
+            self.check_health()
+
+    def model_fingerprint(self):
+        """Return the loaded model's fingerprint from /status, or None if unavailable
+
+        All nodes are expected to serve the same model, so the first available one is
+        asked; while every node's circuit is open Rasa isn't called at all. /status is
+        only served when Rasa runs with --enable-api.
+        """
+        node = next((node for node in self.nodes if node.available()), None)
+        if node is None:
+            return None
+        try:
+            response = self.session.get(f"{node.url}/status", timeout=self.timeout)
+            if response.status_code != 200:
+                return None
+            status = response.json()
+            return status.get("fingerprint") or status.get("model_file")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug("Could not read Rasa model fingerprint error=%s", e)
+            return None
+
+    def close(self):
+        self._closed.set()
+        if self._session is not None and self._pid == os.getpid():
+            self._session.close()
+        self._session = None
+
+
+# Shared blocking client used by the Flask routes
+client = RasaClient()
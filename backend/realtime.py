@@ -0,0 +1,80 @@
+import logging
+import os
+
+import socketio
+
+from cache import LRUCache
+from database import conversation_object_id
+from serialization import SocketIOJSON
+
+logger = logging.getLogger(__name__)
+
+# Socket.IO server sharing the Flask process. Clients emit `subscribe` with a
+# conversation_id and then receive a `message` event for every message persisted
+# to that conversation, instead of re-fetching /chat/<conversation_id>. Either of
+# a conversation's IDs (UUID or ObjectId) works: rooms are named by the ObjectId.
+# With several server processes, SOCKETIO_MESSAGE_QUEUE (a Redis URL) relays
+# events between them.
+MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+sio = socketio.Server(
+    async_mode='threading', cors_allowed_origins='*', json=SocketIOJSON,
+    client_manager=socketio.RedisManager(MESSAGE_QUEUE) if MESSAGE_QUEUE else None
+)
+
+# Conversation ID (either form) -> ObjectId string. The mapping never changes, so
+# entries stay until evicted.
+_rooms = LRUCache(max_entries=10000, ttl=24 * 3600)
+
+
+def room_for(conversation_id: str):
+    """Name of a conversation's room, whichever of its IDs is given (None if unknown)"""
+    room = _rooms.peek(conversation_id)
+    if room is None:
+        room = conversation_object_id(conversation_id)
+        if room is not None:
+            _rooms.set(conversation_id, room)
+    return room
+
+
+@sio.event
+def subscribe(sid, data):
+    conversation_id = (data or {}).get('conversation_id')
+    if not conversation_id:
+        return {'error': 'conversation_id is required'}
+    room = room_for(conversation_id)
+    if room is None:
+        return {'error': 'Conversation not found'}
+    sio.enter_room(sid, room)
+    logger.debug("Client subscribed sid=%s conversation_id=%s", sid, room)
+    return {'subscribed': room}
+
+
+@sio.event
+def unsubscribe(sid, data):
+    conversation_id = (data or {}).get('conversation_id')
+    room = room_for(conversation_id) if conversation_id else None
+    if room:
+        sio.leave_room(sid, room)
+    return {'unsubscribed': room}
+
+
+def publish_messages(conversation_id: str, messages: list):
+    """Push persisted messages to every client subscribed to the conversation
+
+    Events carry the ObjectId form of conversation_id, as the subscribe ack does.
+    """
+    try:
+        room = room_for(conversation_id)
+    except Exception as e:
+        logger.error("Failed to resolve conversation room conversation_id=%s error=%s", conversation_id, e)
+        return
+    if room is None:
+        return
+    for message in messages:
+        try:
+            sio.emit('message', {
+                'conversation_id': room,
+                'message': message
+            }, room=room)
+        except Exception as e:
+            logger.error("Failed to publish message conversation_id=%s error=%s", conversation_id, e)
@@ -0,0 +1,168 @@
+import logging
+import os
+import re
+import threading
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cache of Rasa replies for intents whose answer never depends on the
+# conversation. A cached turn is not sent to Rasa, so it is not recorded in the
+# tracker either: only allowlist intents handled by "anytime" rules.
+RASA_RESPONSE_CACHE = os.getenv('RASA_RESPONSE_CACHE', 'false').lower() == 'true'
+CACHE_INTENTS = [i.strip() for i in os.getenv('RASA_CACHE_INTENTS', 'bot_challenge').split(',') if i.strip()]
+CACHE_TTL = int(os.getenv('RASA_CACHE_TTL', '3600'))
+CACHE_MAX_ENTRIES = int(os.getenv('RASA_CACHE_MAX_ENTRIES', '5000'))
+# How often to check Rasa's model fingerprint, from a background thread; a new
+# model clears the cache
+FINGERPRINT_INTERVAL = float(os.getenv('RASA_CACHE_FINGERPRINT_INTERVAL', '30'))
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def normalize(message: str):
+    """Normalize user input so trivially different spellings share a cache entry"""
+    text = re.sub(r"\s+", " ", message.strip().lower())
+    return text.rstrip(" .!?")
+
+
+def _flows(path: str, key: str):
+    if not os.path.exists(path):
+        return []
+    import yaml
+
+    with open(path, encoding='utf-8') as f:
+        return [flow.get('steps', []) for flow in (yaml.safe_load(f) or {}).get(key, [])]
+
+
+def _step_intents(step: dict):
+    if 'intent' in step:
+        return {step['intent']}
+    if 'or' in step:
+        return {alternative['intent'] for alternative in step['or'] if 'intent' in alternative}
+    return None
+
+
+def load_cacheable_texts(intents: list, domain_path: str = None, rules_path: str = None,
+                         stories_path: str = None):
+    """Return the reply texts that only the allowlisted intents can produce
+
+    The REST webhook doesn't report the predicted intent, so replies are matched
+    against the response templates that the single-step rules in rules.yml map
+    each allowlisted intent to. A template is left out if any other intent can
+    lead to it in a rule or story (e.g. deny -> utter_goodbye), and so is a text
+    that another template shares, since such a reply says nothing about the intent.
+    """
+    import yaml
+
+    domain_path = domain_path or os.path.join(BACKEND_DIR, 'domain.yml')
+    rules_path = rules_path or os.path.join(BACKEND_DIR, 'data', 'rules.yml')
+    stories_path = stories_path or os.path.join(BACKEND_DIR, 'data', 'stories.yml')
+    with open(domain_path, encoding='utf-8') as f:
+        responses = (yaml.safe_load(f) or {}).get('responses', {})
+    rules = _flows(rules_path, 'rules')
+
+    # The intents each action can follow, across every rule and story
+    followed_by = {}
+    for steps in rules + _flows(stories_path, 'stories'):
+        current = {None}
+        for step in steps:
+            step_intents = _step_intents(step)
+            if step_intents is not None:
+                current = step_intents
+            elif 'action' in step:
+                followed_by.setdefault(step['action'], set()).update(current)
+
+    allowed = set(intents)
+    utterances = {}
+    for steps in rules:
+        if len(steps) == 2 and steps[0].get('intent') in allowed and 'action' in steps[1]:
+            action = steps[1]['action']
+            if followed_by.get(action, set()) <= allowed:
+                utterances.setdefault(steps[0]['intent'], set()).add(action)
+
+    def fixed_texts(utterance: str):
+        # Templates with slots or extra payloads aren't fixed replies
+        return {variation['text'] for variation in responses.get(utterance, [])
+                if variation.get('text') and '{' not in variation['text'] and set(variation) == {'text'}}
+
+    cacheable = set().union(*utterances.values()) if utterances else set()
+    shared = set()
+    for utterance, variations in responses.items():
+        if utterance not in cacheable:
+            shared.update(variation.get('text') for variation in variations or [])
+    texts = set()
+    for intent in intents:
+        intent_texts = {text for utterance in utterances.get(intent, ()) for text in fixed_texts(utterance)} - shared
+        if not intent_texts:
+            logger.warning("Rasa response cache: intent=%s has no reply only it can produce; "
+                           "its replies won't be cached", intent)
+        texts |= intent_texts
+    return texts
+
+
+class RasaResponseCache:
+    """TTL/LRU cache of Rasa replies keyed on normalized message text"""
+
+    def __init__(self, rasa_client, intents: list = CACHE_INTENTS, ttl: int = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, fingerprint_interval: float = FINGERPRINT_INTERVAL):
+        self.rasa_client = rasa_client
+        self.cacheable_texts = load_cacheable_texts(intents)
+        self.entries = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.fingerprint_interval = fingerprint_interval
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._fingerprint_thread = None
+
+    def get(self, message: str, sender_id: str):
+        self._start_fingerprint_checks()
+        texts = self.entries.get(normalize(message))
+        if texts is None:
+            return None
+        return [{"recipient_id": sender_id, "text": text} for text in texts]
+
+    def store(self, message: str, reply: list):
+        """Cache a reply if every bubble in it is one of the allowlisted fixed responses"""
+        if not reply or not self.cacheable_texts:
+            return False
+        if any(set(bubble) - {'recipient_id', 'text'} or bubble.get('text') not in self.cacheable_texts
+               for bubble in reply):
+            return False
+        self.entries.set(normalize(message), [bubble['text'] for bubble in reply])
+        return True
+
+    def stats(self):
+        stats = self.entries.stats.as_dict()
+        stats['entries'] = len(self.entries)
+        return stats
+
+    def close(self):
+        self._closed.set()
+
+    def _start_fingerprint_checks(self):
+        # /status can be as slow as Rasa itself, so it is polled off the request path.
+        # Threads don't survive fork(), so a forked worker starts its own poller.
+        if self._fingerprint_thread is not None and self._fingerprint_thread.is_alive():
+            return
+        with self._lock:
+            if self._fingerprint_thread is not None and self._fingerprint_thread.is_alive():
+                return
+            self._fingerprint_thread = threading.Thread(target=self._fingerprint_loop, name='rasa-fingerprint',
+                                                        daemon=True)
+            self._fingerprint_thread.start()
+
+    def _fingerprint_loop(self):
+        self._check_fingerprint()
+        while not self._closed.wait(self.fingerprint_interval):
+            self._check_fingerprint()
+
+    def _check_fingerprint(self):
+        fingerprint = self.rasa_client.model_fingerprint()
+        if fingerprint is None:
+            return
+        if self._fingerprint is not None and fingerprint != self._fingerprint:
+            logger.info("Rasa model changed, clearing response cache")
+            self.entries.clear()
+        self._fingerprint = fingerprint
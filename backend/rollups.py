@@ -0,0 +1,113 @@
+from datetime import datetime
+
+# Daily analytics rollups. Every message write adds its counts to one document per
+# (user, day) and to the all-users document for that day, so reports read a few
+# small documents instead of scanning messages arrays.
+ALL_USERS = "__all__"
+# Upper bounds (ms) of the Rasa response latency histogram; the last bucket is open
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+# Senders counted by name; anything else is counted as "other"
+SENDERS = ("user", "ai")
+# Metadata the server sets on the replies it builds. Only "ai" messages are counted
+# by it, and the API strips these keys from the metadata clients send.
+COUNTED_METADATA = ("source", "error", "intent", "confidence", "response_time_ms")
+# Longest range /stats reports on
+MAX_REPORT_DAYS = 366
+
+
+def day_of(timestamp: datetime):
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+def rollup_id(user_id: str, day: datetime):
+    return f"{user_id}|{day:%Y-%m-%d}"
+
+
+def _key(value):
+    # Field names can't contain dots or start with $
+    return str(value).replace(".", "_").lstrip("$") or "unknown"
+
+
+def latency_bucket(ms: float):
+    for bound in LATENCY_BUCKETS_MS:
+        if ms <= bound:
+            return f"le_{bound}"
+    return "le_inf"
+
+
+def confidence_bucket(confidence: float):
+    """Decile the confidence falls in: p0 for [0, 0.1) up to p90 for [0.9, 1.0], by percent"""
+    return f"p{min(int(float(confidence) * 10), 9) * 10}"
+
+
+def message_increments(message: dict):
+    """The rollup counters one message adds to"""
+    sender = message.get("sender") if message.get("sender") in SENDERS else "other"
+    increments = {"messages": 1, f"by_sender.{sender}": 1}
+    metadata = message.get("metadata")
+    if sender != "ai" or not isinstance(metadata, dict):
+        return increments
+    if metadata.get("source"):
+        increments[f"by_source.{_key(metadata['source'])}"] = 1
+    if metadata.get("error"):
+        increments[f"errors.{_key(metadata['error'])}"] = 1
+    if metadata.get("intent"):
+        increments[f"intents.{_key(metadata['intent'])}"] = 1
+    if isinstance(metadata.get("confidence"), (int, float)):
+        increments[f"confidence.{confidence_bucket(metadata['confidence'])}"] = 1
+    if isinstance(metadata.get("response_time_ms"), (int, float)):
+        increments[f"latency_ms.{latency_bucket(metadata['response_time_ms'])}"] = 1
+        increments["latency_ms_sum"] = metadata["response_time_ms"]
+        increments["latency_ms_count"] = 1
+    return increments
+
+
+def rollup_increments(user_id: str, messages: list, totals: dict = None):
+    """Add messages' counters into `totals`, keyed by rollup _id, and return it
+
+    Each message counts towards its user's rollup and the all-users rollup for the
+    day it was sent.
+    """
+    totals = {} if totals is None else totals
+    for message in messages:
+        day = day_of(message["timestamp"])
+        for owner in (user_id, ALL_USERS):
+            if owner is None:
+                continue
+            entry = totals.setdefault(rollup_id(owner, day), {"user_id": owner, "day": day, "inc": {}})
+            for field, amount in message_increments(message).items():
+                entry["inc"][field] = entry["inc"].get(field, 0) + amount
+    return totals
+
+
+def merge_rollups(docs: list):
+    """Sum rollup documents (e.g. a date range) into one, with latency percentiles"""
+    merged = {}
+
+    def add(target: dict, source: dict):
+        for field, value in source.items():
+            if isinstance(value, dict):
+                add(target.setdefault(field, {}), value)
+            elif isinstance(value, (int, float)):
+                target[field] = target.get(field, 0) + value
+
+    for doc in docs:
+        add(merged, {k: v for k, v in doc.items() if k not in ("_id", "user_id", "day")})
+    histogram = merged.get("latency_ms", {})
+    if histogram:
+        merged["latency_ms_p50"] = latency_percentile(histogram, 50)
+        merged["latency_ms_p95"] = latency_percentile(histogram, 95)
+    return merged
+
+
+def latency_percentile(histogram: dict, pct: float):
+    """Upper bound of the histogram bucket holding the percentile (None past the last bound)"""
+    counts = [(bound, histogram.get(f"le_{bound}", 0)) for bound in LATENCY_BUCKETS_MS]
+    counts.append((None, histogram.get("le_inf", 0)))
+    total = sum(count for _, count in counts)
+    seen = 0
+    for bound, count in counts:
+        seen += count
+        if seen * 100 >= pct * total:
+            return bound
+    return None
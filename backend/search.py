@@ -0,0 +1,138 @@
+import os
+import re
+from datetime import datetime
+
+from database import conversations, message_buckets, message_terms
+from metrics import timed
+from search_index import terms
+
+# Full-text search over a user's message history. Message buckets carry a compound
+# text index (database.ensure_indexes) that starts with the user ID, so a search
+# only reads that user's entries. Embedded conversations have no text index: it
+# would cover the whole messages array, and MongoDB re-tokenizes all of it on
+# every append, so appends would get slower as conversations grow. Their messages
+# are indexed one document each in message_terms (search_index.py), looked up by
+# (user ID, term): whole words only, no phrases, and a -word excludes any
+# conversation containing it.
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '50'))
+SNIPPETS_PER_CONVERSATION = 3
+SNIPPET_CONTEXT = 60  # Characters kept on each side of the first hit
+
+
+def search_terms(query: str, negated: bool = False):
+    """Terms a message has to contain to match (or, with negated=True, the -words)
+
+    Stop words and very short words are dropped, as they are from the index.
+    """
+    words = " ".join(word for minus, word in re.findall(r"(-?)(\w+)", query) if bool(minus) == negated)
+    return terms(words)
+
+
+def snippet_pattern(terms: list):
+    """Regex matching any term as a word prefix
+
+    Terms are trimmed a little to approximate the text index's stemming, so "fees"
+    still highlights "fee".
+    """
+    stems = sorted({term[:max(3, len(term) - 2)] for term in terms}, key=len, reverse=True)
+    return r"\b(" + "|".join(re.escape(stem) for stem in stems) + ")" if stems else None
+
+
+def make_snippet(content: str, pattern: str):
+    """Cut the text around the first hit, marking cuts with ellipses"""
+    match = re.search(pattern, content, re.IGNORECASE) if pattern else None
+    if match is None:
+        return content[:2 * SNIPPET_CONTEXT]
+    start = max(0, match.start() - SNIPPET_CONTEXT)
+    end = min(len(content), match.end() + SNIPPET_CONTEXT)
+    return ("..." if start else "") + content[start:end] + ("..." if end < len(content) else "")
+
+
+def _matches(pattern: str):
+    """Fields counting and keeping the messages that contain a term"""
+    has_term = {"$regexMatch": {"input": {"$ifNull": ["$$m.content", ""]}, "regex": pattern, "options": "i"}}
+    matching = {"$filter": {"input": "$messages", "as": "m", "cond": has_term}}
+    return {
+        "hits": {"$size": matching},
+        "matches": {"$slice": [matching, SNIPPETS_PER_CONVERSATION]}
+    }
+
+
+def _bucket_stages(user_id: str, query: str, limit: int, pattern: str):
+    """Best text-score buckets of the user, with their matching messages"""
+    return [
+        {"$match": {"user_id": user_id, "$text": {"$search": query}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$sort": {"score": -1}},
+        {"$limit": limit},
+        {"$project": {"conversation": 1, **_matches(pattern)}}
+    ]
+
+
+def _index_stages(user_id: str, wanted: list, excluded: list, limit: int):
+    """Embedded conversations of the user with the most messages holding a term"""
+    match = {"user_id": user_id, "terms": {"$in": wanted}}
+    if excluded:
+        match["conversation"] = {"$nin": message_terms.distinct(
+            "conversation", {"user_id": user_id, "terms": {"$in": excluded}}
+        )}
+    return [
+        {"$match": match},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$conversation",
+            "hits": {"$sum": 1},
+            "matches": {"$push": {"message_id": "$message_id", "sender": "$sender",
+                                  "timestamp": "$timestamp", "content": "$content"}}
+        }},
+        {"$sort": {"hits": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$project": {"hits": 1, "matches": {"$slice": ["$matches", SNIPPETS_PER_CONVERSATION]}}}
+    ]
+
+
+def search_conversations(user_id: str, query: str, limit: int = 20):
+    """Return a user's conversations matching `query`, most matching messages first
+
+    Words are OR-ed and -words exclude. In bucketed conversations `query` uses
+    MongoDB $text syntax, so "quoted phrases" must appear there too. Each result
+    carries `score`, the number of its messages containing a query word, and up to
+    SNIPPETS_PER_CONVERSATION snippets from them.
+    """
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+    wanted, excluded = search_terms(query), search_terms(query, negated=True)
+    pattern = snippet_pattern(wanted)
+    if pattern is None:
+        return []
+
+    with timed("mongo_read"):
+        hits = {hit["_id"]: hit for hit in message_terms.aggregate(_index_stages(user_id, wanted, excluded, limit))}
+
+        # A bucketed conversation can match in several buckets: add up its hits and
+        # keep its earliest snippets
+        for bucket in message_buckets.aggregate(_bucket_stages(user_id, query, limit, pattern)):
+            hit = hits.setdefault(bucket["conversation"], {"_id": bucket["conversation"], "hits": 0, "matches": []})
+            hit["hits"] += bucket["hits"]
+            hit["matches"].extend(bucket["matches"])
+
+        results = []
+        if hits:
+            headers = conversations.find({"_id": {"$in": list(hits)}}, {"conversation_id": 1, "updated_at": 1})
+            for header in headers:
+                hit = hits[header["_id"]]
+                hit.update(header)
+                hit["matches"] = sorted(hit["matches"], key=lambda m: m["timestamp"])[:SNIPPETS_PER_CONVERSATION]
+                results.append(hit)
+
+    results.sort(key=lambda hit: (hit["hits"], hit.get("updated_at") or datetime.min), reverse=True)
+    return [{
+        'conversation_id': str(hit['_id']),
+        'score': hit['hits'],
+        'updated_at': hit.get('updated_at'),
+        'snippets': [{
+            'message_id': message.get('message_id'),
+            'sender': message.get('sender'),
+            'timestamp': message.get('timestamp'),
+            'snippet': make_snippet(message.get('content') or '', pattern),
+        } for message in hit['matches']],
+    } for hit in results[:limit]]
@@ -0,0 +1,37 @@
+import re
+
+# Terms of the per-message search index (database.message_terms, queried by
+# search.py). A message is indexed under the set of its words, lowercased, with
+# stop words and very short words left out and plurals folded to the singular, so
+# "fees" finds "fee" and "what are the fees" only looks for "fee". Queries go
+# through the same function, so both sides always agree on the terms.
+MIN_TERM_LENGTH = 2
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these they this those
+through to too under until up very was we were what when where which while who whom why will with
+would you your yours yourself yourselves
+""".split())
+
+
+def stem(word: str):
+    """Fold a plural to its singular ("fees" -> "fee", "classes" -> "class", "fries" -> "fry")"""
+    if word.endswith("sses"):
+        return word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith(("ss", "us")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def terms(text: str):
+    """The index terms of a text, in order of first appearance"""
+    seen = {}
+    for word in re.findall(r"\w+", (text or "").lower()):
+        if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS:
+            seen.setdefault(stem(word), None)
+    return list(seen)
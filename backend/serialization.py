@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
+
+
+def to_jsonable(obj):
+    """Convert the BSON types MongoDB hands back into JSON-friendly values"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, **kwargs):
+    """Serialize documents straight from MongoDB, with no per-field conversion pass"""
+    if orjson is not None and not kwargs.get('indent'):
+        # orjson writes datetimes natively in the same ISO 8601 form as isoformat()
+        return orjson.dumps(obj, default=to_jsonable, option=orjson.OPT_NON_STR_KEYS).decode()
+    kwargs.setdefault('default', to_jsonable)
+    return json.dumps(obj, **kwargs)
+
+
+def loads(s, **kwargs):
+    if orjson is not None and not kwargs:
+        return orjson.loads(s)
+    return json.loads(s, **kwargs)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that understands ObjectId and datetime (as ISO 8601)"""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        kwargs.pop('sort_keys', None)
+        kwargs.pop('default', None)
+        with timed("serialization"):
+            return dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return loads(s, **kwargs)
+
+
+class SocketIOJSON:
+    """JSON module shim for python-socketio so emitted payloads use the same encoding"""
+
+    dumps = staticmethod(dumps)
+    loads = staticmethod(loads)
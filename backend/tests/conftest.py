@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules are flat top-level modules, as the API and the CLIs import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import search  # noqa: E402
+from cache import LRUCache  # noqa: E402
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Point database.py at a fresh in-memory mongomock database and cache"""
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient()[database.MONGO_DB]
+    for name in ("conversations", "message_buckets", "rollups", "message_terms"):
+        monkeypatch.setattr(database, name, db[name])
+    # search.py imports the collections by name
+    for name in ("conversations", "message_buckets", "message_terms"):
+        monkeypatch.setattr(search, name, db[name])
+    monkeypatch.setattr(database, "cache", LRUCache())
+    return db
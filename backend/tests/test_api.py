@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from database import add_message_to_conversation, store_conversation
+
+pytest.importorskip("flask")
+pytest.importorskip("socketio")
+import api  # noqa: E402
+
+
+@pytest.fixture
+def client(mongo):
+    return api.app.test_client()
+
+
+def test_since_accepts_javascript_iso_timestamps(client, monkeypatch):
+    # Bucketed windows compare timestamps in Python, where naive vs aware raised TypeError
+    # (the embedded layout's pipeline needs $indexOfArray, which mongomock lacks)
+    monkeypatch.setattr(database, "MESSAGE_STORAGE", "bucketed")
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    add_message_to_conversation(conversation_id, "ai", "hi")
+
+    since = (datetime.utcnow() - timedelta(hours=1)).isoformat(timespec="milliseconds") + "Z"
+    response = client.get(f"/chat/{conversation_id}", query_string={"since": since})
+    assert response.status_code == 200
+    assert [m["content"] for m in response.get_json()["messages"]] == ["hello", "hi"]
+
+    # An offset is converted to UTC before comparing
+    ahead = (datetime.utcnow() + timedelta(minutes=30)).isoformat() + "+01:00"
+    response = client.get(f"/chat/{conversation_id}", query_string={"since": ahead})
+    assert len(response.get_json()["messages"]) == 2
+
+
+@pytest.mark.parametrize("limit", ["0", "-2", "abc"])
+def test_window_rejects_bad_limits(client, limit):
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    assert client.get(f"/chat/{conversation_id}", query_string={"limit": limit}).status_code == 400
+
+
+def test_message_to_rasa_tracker_id_does_not_touch_the_tracker(client, mongo):
+    # The Rasa tracker store keeps its documents in the same collection
+    tracker_id = str(database.conversations.insert_one({"sender_id": "s1", "events": []}).inserted_id)
+    response = client.post(f"/chat/{tracker_id}/message", json={"sender": "user", "content": "hi"})
+    assert response.status_code != 200
+    assert database.conversations.find_one({"sender_id": "s1"}, {"_id": 0}) == {"sender_id": "s1", "events": []}
+
+
+class FullAfterFirst:
+    """Write-behind queue stand-in that takes one batch and then stays full (or shuts down)"""
+
+    def __init__(self, error):
+        self.error = error
+        self.batches = []
+        self.timeouts = []
+
+    def enqueue(self, conversation_id, messages, timeout=None):
+        self.timeouts.append(timeout)
+        if self.batches:
+            raise self.error
+        self.batches.append(messages)
+
+
+@pytest.mark.parametrize("error", [api.queue.Full(), RuntimeError("Write-behind queue is shut down")])
+@pytest.mark.parametrize("rasa_reply", [[{"text": "Hi!"}], None])
+def test_reply_the_queue_has_no_room_for_is_returned_with_503(client, monkeypatch, error, rasa_reply):
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    write_queue = FullAfterFirst(error)
+    monkeypatch.setattr(api, "WRITE_BEHIND", True)
+    monkeypatch.setattr(api, "get_write_queue", lambda: write_queue)
+    monkeypatch.setattr(api, "get_rasa_response", lambda content, sender: rasa_reply)
+
+    response = client.post(f"/chat/{conversation_id}/message", json={"sender": "user", "content": "hi"})
+    assert response.status_code == 503
+    body = response.get_json()
+    assert body["error"] == "Server busy, reply not saved"
+    assert [m["sender"] for m in body["messages"]] == ["user", "ai"]
+    # The reply waited longer for room than the user message did
+    assert write_queue.timeouts == [api.ENQUEUE_TIMEOUT, api.REPLY_ENQUEUE_TIMEOUT]
+
+
+def test_client_cannot_set_counted_metadata(client, monkeypatch):
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    monkeypatch.setattr(api, "get_rasa_response", lambda content, sender: [{"text": "Hi!"}])
+    response = client.post(f"/chat/{conversation_id}/message", json={
+        "sender": "user", "content": "hi", "metadata": {"device": "ios", "error": "rasa_no_response"}
+    })
+    assert response.get_json()["messages"][0]["metadata"] == {"device": "ios"}
+
+    response = client.post(f"/chat/{conversation_id}/message", json={"sender": "user", "content": "hi", "metadata": [1]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("days", ["0", "-1", "99999999"])
+def test_stats_rejects_out_of_range_days(client, days):
+    assert client.get("/stats", query_string={"days": days}).status_code == 400
+
+
+@pytest.mark.parametrize("params", [
+    {"per_page": "0", "cursor": ""}, {"per_page": "0"}, {"per_page": "-5"}, {"page": "0"}, {"per_page": "x"}
+])
+def test_recent_chats_rejects_bad_paging(client, params):
+    store_conversation("u1", "user", "User", "hello")
+    assert client.get("/recent-chats", query_string={"user_id": "u1", **params}).status_code == 400
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import database
+from cache import LRUCache, RedisCache, create_cache
+from database import add_message_to_conversation, get_conversations, get_single_conversation, store_conversation
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, mongo, monkeypatch):
+    """Run a test against the LRU backend and against RedisCache on fakeredis"""
+    if request.param == "memory":
+        cache = LRUCache(max_entries=100, ttl=60)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        cache = RedisCache(ttl=60, client=fakeredis.FakeRedis())
+    monkeypatch.setattr(database, "cache", cache)
+    return cache
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    cache = LRUCache(max_entries=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats.as_dict()["evictions"] == 1
+
+
+def test_create_cache_reads_settings_when_called(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "none")
+    assert create_cache().name == "none"
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("CACHE_MAX_ENTRIES", "7")
+    assert create_cache().max_entries == 7
+
+
+def test_reads_are_served_from_cache_until_a_write(backend):
+    conversation = store_conversation("u1", "user", "User", "hello")
+    conversation_id = conversation["conversation_id"]
+
+    first = get_single_conversation(conversation_id)
+    hits = backend.stats.hits
+    assert get_single_conversation(conversation_id) == first
+    assert backend.stats.hits == hits + 1
+
+    add_message_to_conversation(conversation_id, "ai", "hi there")
+    assert [m["content"] for m in get_single_conversation(conversation_id)["messages"]] == ["hello", "hi there"]
+    # The ObjectId form names the same conversation and is dropped by the same write
+    by_object_id = get_single_conversation(conversation["_id"])
+    add_message_to_conversation(conversation_id, "user", "again")
+    assert len(get_single_conversation(conversation["_id"])["messages"]) == len(by_object_id["messages"]) + 1
+
+
+def test_read_overlapping_a_write_does_not_recache_stale_data(backend, monkeypatch):
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    real_find_one = database.conversations.find_one
+
+    def find_one_then_write(*args, **kwargs):
+        stale = real_find_one(*args, **kwargs)
+        # Another request appends a message after this read and before it is cached
+        monkeypatch.setattr(database.conversations, "find_one", real_find_one)
+        add_message_to_conversation(conversation_id, "ai", "written meanwhile")
+        return stale
+
+    monkeypatch.setattr(database.conversations, "find_one", find_one_then_write)
+    assert len(get_single_conversation(conversation_id)["messages"]) == 1
+    assert len(get_single_conversation(conversation_id)["messages"]) == 2
+
+
+def test_new_conversation_drops_cached_lists_and_counts(backend):
+    store_conversation("u1", "user", "User", "first")
+    assert get_conversations("u1")[1] == 1
+    store_conversation("u1", "user", "User", "second")
+    conversations, total = get_conversations("u1")
+    assert total == 2
+    assert [c["messages"][0]["content"] for c in conversations] == ["second", "first"]
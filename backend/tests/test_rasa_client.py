@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.stub_rasa import start_stub
+from rasa_client import CircuitBreaker, ConcurrencyGate, RasaClient
+
+
+@pytest.fixture
+def stub():
+    server, url = start_stub()
+    yield server.RequestHandlerClass, url
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(url, **kwargs):
+    client = RasaClient(url, read_timeout=kwargs.pop("read_timeout", 1), retries=kwargs.pop("retries", 0),
+                        backoff=0.01, **kwargs)
+    client.nodes[0].breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    return client
+
+
+def test_breaker_opens_after_failures_and_fails_fast(stub):
+    handler, url = stub
+    client = make_client(url)
+    handler.error_rate = 1.0
+    for i in range(3):
+        assert client.send_message("hi", f"s{i}") is None
+    assert client.nodes[0].breaker.state == CircuitBreaker.OPEN
+
+    handler.senders.clear()
+    start = time.perf_counter()
+    assert client.send_message("hi", "fast") is None
+    assert time.perf_counter() - start < 0.05
+    assert not handler.senders
+    client.close()
+
+
+def test_half_open_probe_closes_circuit_on_success(stub):
+    handler, url = stub
+    client = make_client(url)
+    handler.error_rate = 1.0
+    for i in range(3):
+        client.send_message("hi", f"s{i}")
+    handler.error_rate = 0.0
+    time.sleep(0.25)
+
+    assert client.send_message("hi", "probe") == [{"recipient_id": "probe", "text": "Hey! How are you?"}]
+    assert client.nodes[0].breaker.state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_non_json_reply_to_probe_reopens_circuit(stub):
+    handler, url = stub
+    client = make_client(url)
+    handler.error_rate = 1.0
+    for i in range(3):
+        client.send_message("hi", f"s{i}")
+    handler.error_rate = 0.0
+    handler.malformed = True
+    time.sleep(0.25)
+
+    assert client.send_message("hi", "probe") is None
+    breaker = client.nodes[0].breaker
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # The breaker is not stuck: the next probe goes through once the stub recovers
+    handler.malformed = False
+    time.sleep(0.25)
+    assert client.send_message("hi", "probe") is not None
+    assert breaker.state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_probe_slot_is_returned_when_the_call_never_completes(stub, monkeypatch):
+    handler, url = stub
+    client = make_client(url)
+    breaker = client.nodes[0].breaker
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.25)
+
+    def broken_post(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(client, "_post", broken_post)
+    with pytest.raises(RuntimeError):
+        client.send_message("hi", "probe")
+    monkeypatch.undo()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert client.send_message("hi", "probe") is not None
+    assert breaker.state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_read_timeout_is_not_retried(stub):
+    handler, url = stub
+    client = make_client(url, read_timeout=0.1, retries=2)
+    handler.latency = 0.3
+
+    start = time.perf_counter()
+    assert client.send_message("hi", "slow") is None
+    # Rasa may already have handled the message, so a timed-out call is not sent again
+    assert time.perf_counter() - start < 0.25
+    assert client.nodes[0].breaker.failures == 1
+    client.close()
+
+
+def test_gate_turns_callers_away_instead_of_queueing_behind_rasa(stub):
+    handler, url = stub
+    client = make_client(url)
+    client.gate = ConcurrencyGate(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    handler.latency = 0.5
+
+    first = threading.Thread(target=client.send_message, args=("hi", "first"))
+    first.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    assert client.send_message("hi", "second") is None
+    assert time.perf_counter() - start < 0.3
+    first.join()
+    assert "second" not in handler.senders
+    client.close()
+
+
+def test_fingerprint_is_not_requested_while_the_circuit_is_open(stub):
+    handler, url = stub
+    client = make_client(url)
+    for _ in range(3):
+        client.nodes[0].breaker.record_failure()
+    handler.latency = 0.5
+
+    start = time.perf_counter()
+    assert client.model_fingerprint() is None
+    assert time.perf_counter() - start < 0.05
+    client.close()
+
+
+def test_identical_turns_in_flight_share_one_rasa_call(stub):
+    handler, url = stub
+    client = make_client(url)
+    handler.latency = 0.2
+    replies, sent = [], []
+    send_message = client._send_message
+    client._send_message = lambda message, sender_id: sent.append(message) or send_message(message, sender_id)
+
+    def send(message):
+        replies.append(client.send_message(message, "double"))
+
+    threads = [threading.Thread(target=send, args=(message,)) for message in ("hi", "hi", "hello")]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    # The repeated "hi" reaches Rasa once; a different text is a separate turn
+    assert sorted(sent) == ["hello", "hi"]
+    assert len(replies) == 3
+    assert all(reply for reply in replies)
+    assert client.coalesced == 1
+    client.close()
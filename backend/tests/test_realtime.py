@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("socketio")
+import realtime  # noqa: E402
+import database  # noqa: E402
+from database import store_conversation  # noqa: E402
+
+
+@pytest.fixture
+def emitted(mongo, monkeypatch):
+    monkeypatch.setattr(realtime, "_rooms", realtime.LRUCache())
+    events = []
+    monkeypatch.setattr(realtime.sio, "emit", lambda event, data, room=None: events.append((room, data)))
+    return events
+
+
+def test_both_ids_of_a_conversation_share_one_room(emitted):
+    conversation = store_conversation("u1", "user", "User", "hello")
+    object_id, uuid = conversation["_id"], conversation["conversation_id"]
+
+    assert realtime.room_for(uuid) == object_id
+    assert realtime.room_for(object_id.upper()) == object_id
+
+    realtime.publish_messages(uuid, [{"content": "via uuid"}])
+    realtime.publish_messages(object_id, [{"content": "via object id"}])
+    assert [room for room, _ in emitted] == [object_id, object_id]
+    assert all(data["conversation_id"] == object_id for _, data in emitted)
+
+
+def test_unknown_conversation_is_not_published(emitted):
+    realtime.publish_messages("no-such-conversation", [{"content": "lost"}])
+    assert emitted == []
+    assert realtime.room_for("no-such-conversation") is None
+
+
+def test_rasa_tracker_id_is_not_a_room(emitted):
+    tracker_id = str(database.conversations.insert_one({"sender_id": "s1", "events": []}).inserted_id)
+    assert realtime.room_for(tracker_id) is None
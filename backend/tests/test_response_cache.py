@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from response_cache import RasaResponseCache, load_cacheable_texts
+
+pytest.importorskip("yaml")
+
+
+class NoFingerprint:
+    def model_fingerprint(self):
+        return None
+
+
+def reply(*texts):
+    return [{"recipient_id": "s1", "text": text} for text in texts]
+
+
+def test_reply_another_intent_can_produce_is_not_cacheable(caplog):
+    # stories.yml answers deny with utter_goodbye too, so "Bye" doesn't identify goodbye
+    with caplog.at_level(logging.WARNING):
+        texts = load_cacheable_texts(["goodbye", "bot_challenge"])
+    assert texts == {"I am a bot, powered by Ibrahim."}
+    assert "intent=goodbye" in caplog.text
+
+
+def test_intent_without_a_rule_is_reported(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert load_cacheable_texts(["ask_fees"]) == set()
+    assert "intent=ask_fees" in caplog.text
+
+
+def test_store_only_caches_allowlisted_replies():
+    cache = RasaResponseCache(NoFingerprint(), intents=["goodbye", "bot_challenge"])
+    assert not cache.store("no", reply("Bye"))
+    assert cache.get("no", "s1") is None
+
+    assert cache.store("Are you a bot?", reply("I am a bot, powered by Ibrahim."))
+    assert cache.get("are you a bot", "s2") == [{"recipient_id": "s2", "text": "I am a bot, powered by Ibrahim."}]
+
+
+class SlowFingerprint:
+    """Rasa stand-in whose /status is slow and reports a new model on every call"""
+
+    def __init__(self):
+        self.calls = 0
+        self.called = threading.Event()
+
+    def model_fingerprint(self):
+        self.calls += 1
+        time.sleep(0.2)
+        self.called.set()
+        return f"model-{self.calls}"
+
+
+def test_fingerprint_is_polled_off_the_request_path():
+    rasa = SlowFingerprint()
+    cache = RasaResponseCache(rasa, intents=["bot_challenge"], fingerprint_interval=0.05)
+    start = time.perf_counter()
+    assert cache.get("are you a bot", "s1") is None
+    assert time.perf_counter() - start < 0.1
+
+    assert rasa.called.wait(1)
+    cache.store("are you a bot", reply("I am a bot, powered by Ibrahim."))
+    # The next poll sees a new model and clears the cache
+    deadline = time.monotonic() + 2
+    while cache.get("are you a bot", "s1") is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    cache.close()
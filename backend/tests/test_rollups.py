@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import backfill_rollups
+import database
+from database import store_conversation
+from rollups import message_increments, rollup_id
+
+
+def test_backfill_writes_counts_with_rollups_off(mongo, monkeypatch):
+    monkeypatch.setattr(database, "ROLLUPS", False)
+    monkeypatch.setattr(backfill_rollups, "rollups", database.rollups)
+    monkeypatch.setattr(backfill_rollups, "conversations", database.conversations)
+    monkeypatch.setattr(backfill_rollups, "message_buckets", database.message_buckets)
+    store_conversation("u1", "user", "User", "hello")
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    database.rollups.insert_one({"_id": rollup_id("u1", today), "user_id": "u1", "day": today, "messages": 99})
+
+    # Bounds that are not midnight still rebuild whole days
+    counted = backfill_rollups.backfill(today + timedelta(hours=5), today + timedelta(days=1, hours=5))
+    assert counted == 1
+    assert database.rollups.find_one({"_id": rollup_id("u1", today)})["messages"] == 1
+
+
+def test_client_supplied_fields_are_not_counted():
+    spoofed = {"sender": "$where.x", "timestamp": datetime.utcnow(),
+               "metadata": {"error": "rasa_no_response", "intent": "x.y", "response_time_ms": 1}}
+    user = {"sender": "user", "timestamp": datetime.utcnow(), "metadata": {"source": "rasa", "confidence": 0.9}}
+    assert message_increments(spoofed) == {"messages": 1, "by_sender.other": 1}
+    assert message_increments(user) == {"messages": 1, "by_sender.user": 1}
+
+    reply = {"sender": "ai", "metadata": {"source": "rasa", "response_time_ms": 80}}
+    assert message_increments(reply)["by_source.rasa"] == 1
+    assert message_increments(reply)["latency_ms.le_100"] == 1
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import database
+from database import add_message_to_conversation, store_conversation
+from search import search_conversations
+from search_index import terms
+
+
+def test_embedded_conversations_are_found_through_the_index(mongo):
+    fees = store_conversation("u1", "user", "User", "What are the fees for nursing?", response="Fees vary by course")
+    store_conversation("u1", "user", "User", "Is there a hostel?")
+    store_conversation("u2", "user", "User", "fees please")
+
+    results = search_conversations("u1", "fees")
+    assert [result["conversation_id"] for result in results] == [fees["_id"]]
+    assert results[0]["score"] == 2
+    assert results[0]["snippets"][0]["snippet"] == "What are the fees for nursing?"
+
+
+def test_old_conversations_are_found(mongo):
+    old = store_conversation("u1", "user", "User", "hello")
+    add_message_to_conversation(old["conversation_id"], "user", "what is the scholarship deadline")
+    database.conversations.update_one({"conversation_id": old["conversation_id"]},
+                                      {"$set": {"updated_at": datetime.utcnow() - timedelta(days=900)}})
+    for i in range(250):
+        store_conversation("u1", "user", "User", f"question {i}")
+
+    assert [result["conversation_id"] for result in search_conversations("u1", "scholarships")] == [old["_id"]]
+
+
+def test_stop_words_neither_match_nor_rank(mongo):
+    store_conversation("u1", "user", "User", "the the the the")
+    fees = store_conversation("u1", "user", "User", "Fees for nursing", response="The fee is 100")
+
+    assert terms("what are the fees") == ["fee"]
+    assert [result["conversation_id"] for result in search_conversations("u1", "what are the fees")] == [fees["_id"]]
+    assert search_conversations("u1", "what are the") == []
+
+
+def test_negated_words_exclude_embedded_conversations(mongo):
+    store_conversation("u1", "user", "User", "fees for the hostel")
+    kept = store_conversation("u1", "user", "User", "fees for nursing")
+
+    assert [result["conversation_id"] for result in search_conversations("u1", "fees -hostel")] == [kept["_id"]]
+
+
+def test_replayed_messages_are_indexed_once(mongo):
+    conversation = store_conversation("u1", "user", "User", "hello")
+    message = database.build_message("user", "refund policy")
+    database.add_messages_bulk([(conversation["conversation_id"], [message])])
+    database.add_messages_bulk([(conversation["conversation_id"], [message])])
+
+    assert database.message_terms.count_documents({"terms": "refund"}) == 1
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import database
+from database import add_message_to_conversation, repair_summary_counters, store_conversation
+
+THREADS = 8
+MESSAGES_PER_THREAD = 25
+
+
+@pytest.mark.parametrize("storage", ["embedded", "bucketed"])
+def test_concurrent_writers_keep_an_exact_count(mongo, monkeypatch, storage):
+    monkeypatch.setattr(database, "MESSAGE_STORAGE", storage)
+    monkeypatch.setattr(database, "BUCKET_SIZE", 10)
+    conversation_id = store_conversation("u1", "user", "User", "hello")["conversation_id"]
+    start = threading.Barrier(THREADS)
+    errors = []
+
+    def writer(n):
+        start.wait()
+        try:
+            for i in range(MESSAGES_PER_THREAD):
+                add_message_to_conversation(conversation_id, "user", f"{n}-{i}")
+        except Exception as e:  # Surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    conversation = database.get_single_conversation(conversation_id)
+    expected = 1 + THREADS * MESSAGES_PER_THREAD
+    assert conversation["summary"]["total_messages"] == expected
+    assert len(conversation["messages"]) == expected
+    assert len({message["message_id"] for message in conversation["messages"]}) == expected
+
+
+def test_repair_fixes_corrupted_counters_only(mongo):
+    conversation_id = store_conversation("u1", "user", "User", "hello", response="hi")["conversation_id"]
+    # What the old $set of an {"$add": ...} document left behind
+    mongo.conversations.update_one(
+        {"conversation_id": conversation_id},
+        {"$set": {"summary.total_messages": {"$add": ["$summary.total_messages", 1]}}}
+    )
+    mongo.conversations.insert_one({"sender_id": "rasa-tracker", "events": []})
+
+    assert repair_summary_counters() == 1
+    assert "summary" not in mongo.conversations.find_one({"sender_id": "rasa-tracker"})
+    assert add_message_to_conversation(conversation_id, "user", "again")
+    assert database.get_single_conversation(conversation_id)["summary"]["total_messages"] == 3
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from bson import json_util
+from pymongo.errors import AutoReconnect
+
+import database
+import write_queue
+from database import build_message, store_conversation
+from write_queue import WriteBehindQueue
+
+
+class FlakyWriter:
+    """write_batch stand-in that records what it is given and can be told to fail"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+        self.written = []
+
+    def __call__(self, batches):
+        self.calls.append(batches)
+        if self.error is not None:
+            raise self.error
+        self.written.extend(batches)
+        return []
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def log_lines(path):
+    with open(path, 'rb') as f:
+        return [json_util.loads(line) for line in f.read().splitlines()]
+
+
+def test_replay_keeps_log_while_mongo_is_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "MAX_BACKOFF", 0.01)
+    log = tmp_path / "wb.log"
+    log.write_text(json_util.dumps({"c": "a", "m": [{"message_id": "m1"}]}) + "\n")
+
+    writer = FlakyWriter(AutoReconnect("down"))
+    wq = WriteBehindQueue(log_path=str(log), flush_interval=0.01, write_batch=writer)
+    wait_for(lambda: len(writer.calls) >= 5)
+    wq.close()
+
+    # Shutting down mid-outage must not lose the replayed entry
+    assert [entry["c"] for entry in log_lines(log)] == ["a"]
+    assert wq.failed_batches == 0
+
+
+def test_replay_runs_on_worker_and_truncates_after_success(tmp_path):
+    log = tmp_path / "wb.log"
+    # A torn last line from a crash is skipped, not treated as the end of the log
+    log.write_text(json_util.dumps({"c": "a", "m": [{"message_id": "m1"}]}) + "\n{\"c\": \"b\", \"m")
+
+    writer = FlakyWriter()
+    wq = WriteBehindQueue(log_path=str(log), flush_interval=0.01, write_batch=writer)
+    wq.enqueue("c", [{"message_id": "m2"}])
+    wait_for(lambda: wq.flushed == 2)
+    wq.close()
+
+    assert [conversation_id for batch in writer.calls for conversation_id, _ in batch] == ["a", "c"]
+    assert log.read_bytes() == b""
+
+
+def test_failed_batch_is_dead_lettered_and_log_still_compacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "MAX_BACKOFF", 0.01)
+    log = tmp_path / "wb.log"
+    writer = FlakyWriter(ValueError("bad document"))
+    wq = WriteBehindQueue(log_path=str(log), flush_interval=0.01, write_batch=writer)
+    wq.enqueue("a", [{"message_id": "m1"}])
+    wait_for(lambda: wq.failed_batches == 1)
+
+    writer.error = None
+    for i in range(3):
+        wq.enqueue("b", [{"message_id": f"b{i}"}])
+    wait_for(lambda: wq.flushed == 3)
+    wq.close()
+
+    assert [entry["c"] for entry in log_lines(str(log) + ".failed")] == ["a"]
+    # The dropped item no longer pins the log, so nothing is replayed on restart
+    assert log.read_bytes() == b""
+
+
+def test_enqueue_does_not_wait_for_replay(tmp_path):
+    log = tmp_path / "wb.log"
+    log.write_text(json_util.dumps({"c": "a", "m": [{"message_id": "m1"}]}) + "\n")
+    release = threading.Event()
+
+    def slow_writer(batches):
+        release.wait(5)
+        return []
+
+    start = time.monotonic()
+    wq = WriteBehindQueue(log_path=str(log), flush_interval=0.01, write_batch=slow_writer)
+    wq.enqueue("b", [{"message_id": "m2"}])
+    assert time.monotonic() - start < 1
+    release.set()
+    wait_for(lambda: wq.flushed == 2)
+    wq.close()
+
+
+def test_bulk_append_is_idempotent(mongo, monkeypatch):
+    embedded = store_conversation("u1", "user", "User", "hello")
+    monkeypatch.setattr(database, "MESSAGE_STORAGE", "bucketed")
+    bucketed = store_conversation("u1", "user", "User", "hello")
+
+    first = [build_message("user", "one"), build_message("ai", "two")]
+    second = first + [build_message("user", "three")]
+    for conversation in (embedded, bucketed):
+        database.add_messages_bulk([(conversation["conversation_id"], first)])
+        # A retry or replay that overlaps what was already written
+        database.add_messages_bulk([(conversation["conversation_id"], second)])
+
+        stored = database.get_single_conversation(conversation["conversation_id"])
+        contents = [message["content"] for message in stored["messages"]]
+        assert contents == ["hello", "one", "two", "three"]
+        assert stored["summary"]["total_messages"] == 4
@@ -0,0 +1,229 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from bson import json_util
+from pymongo.errors import ConnectionFailure
+
+from database import add_messages_bulk
+
+logger = logging.getLogger(__name__)
+
+# Write-behind settings. With WRITE_BEHIND enabled, add_message returns once the
+# messages are queued (and, with WRITE_BEHIND_LOG, appended to a local log), and a
+# background thread persists them to MongoDB in batches.
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'false').lower() == 'true'
+QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '500'))
+FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))
+ENQUEUE_TIMEOUT = float(os.getenv('WRITE_BEHIND_ENQUEUE_TIMEOUT', '1'))
+# Replies wait longer for room: Rasa has already handled the turn, so turning one
+# away loses it rather than asking the client to retry
+REPLY_ENQUEUE_TIMEOUT = float(os.getenv('WRITE_BEHIND_REPLY_TIMEOUT', '10'))
+LOG_PATH = os.getenv('WRITE_BEHIND_LOG')
+MAX_ATTEMPTS = 3
+MAX_BACKOFF = 5.0
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue of pending message appends, flushed by one worker thread
+
+    Items are flushed in arrival order by a single thread, and each batch merges a
+    conversation's pending messages into one append, so per-conversation ordering
+    is preserved. When a log path is given every item is appended to it before
+    enqueue() returns; the worker replays what an earlier process left in the log
+    before taking new items, and the log is only truncated once every item in it
+    has been settled. Appends skip messages that are already stored, so replaying
+    an item that was written before a crash is harmless.
+
+    While MongoDB is unreachable a batch is retried until it goes through (new
+    writes back up into the queue and then get queue.Full). A batch that fails for
+    any other reason is given up after MAX_ATTEMPTS and moved to `<log>.failed`.
+    """
+
+    def __init__(self, maxsize: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, log_path: str = LOG_PATH, write_batch=add_messages_bulk):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log_path = log_path
+        self.write_batch = write_batch
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._log_lock = threading.Lock()
+        self._log = None
+        # Items enqueued but not yet written (or dead-lettered); guarded by _log_lock
+        self._pending = 0
+        self._replay_bytes = 0
+        self._stopping = threading.Event()
+        self.flushed = 0
+        self.failed_batches = 0
+        if log_path:
+            self._log = open(log_path, 'a+b')
+            self._replay_bytes = self._log.tell()
+            if self._replay_bytes:
+                # Start new entries on a fresh line, after a possibly torn last one
+                self._log.seek(-1, os.SEEK_END)
+                if self._log.read(1) != b"\n":
+                    self._log.write(b"\n")
+                    self._log.flush()
+        self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._worker.start()
+
+    def enqueue(self, conversation_id: str, messages: list, timeout: float = ENQUEUE_TIMEOUT):
+        """Queue messages for a conversation. Raises queue.Full when the queue stays full."""
+        if self._stopping.is_set():
+            raise RuntimeError("Write-behind queue is shut down")
+        # Counted before the worker can see the item, so the log is never truncated
+        # under an entry that has not been settled
+        with self._log_lock:
+            self._pending += 1
+        try:
+            self._queue.put((conversation_id, messages), timeout=timeout)
+        except queue.Full:
+            with self._log_lock:
+                self._pending -= 1
+            raise
+        if self._log is not None:
+            with self._log_lock:
+                self._log.write(self._encode(conversation_id, messages))
+                self._log.flush()
+                os.fsync(self._log.fileno())
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 30):
+        """Stop accepting writes and flush everything still queued"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._worker.join(timeout)
+        if self._log is not None:
+            with self._log_lock:
+                self._log.close()
+
+    def _run(self):
+        if self._replay_bytes and not self._replay():
+            return
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                if not self._flush(batch):
+                    return
+                self._settle(len(batch))
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list):
+        """Write a batch, returning False if it was left unwritten because of shutdown"""
+        # Merge each conversation's messages in arrival order
+        merged = {}
+        for conversation_id, messages in batch:
+            merged.setdefault(conversation_id, []).extend(messages)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                missing = self.write_batch(list(merged.items()))
+                break
+            except ConnectionFailure as e:
+                logger.error("Write-behind flush failed attempt=%d error=%s", attempt, e)
+                if self._stopping.is_set() and attempt >= MAX_ATTEMPTS:
+                    # The entries stay in the log for the next start to replay
+                    logger.error("Write-behind stopping with unwritten items=%d log=%s",
+                                 len(batch) + self._queue.qsize(), self.log_path)
+                    return False
+            except Exception as e:
+                logger.error("Write-behind flush failed attempt=%d error=%s", attempt, e)
+                if attempt >= MAX_ATTEMPTS:
+                    self._dead_letter(batch)
+                    return True
+            time.sleep(min(0.5 * (2 ** (attempt - 1)), MAX_BACKOFF))
+        for conversation_id in missing:
+            logger.warning("Write-behind dropped messages for unknown conversation_id=%s", conversation_id)
+        self.flushed += len(batch)
+        return True
+
+    def _dead_letter(self, batch: list):
+        self.failed_batches += 1
+        if not self.log_path:
+            logger.error("Dropping write-behind batch items=%d", len(batch))
+            return
+        with open(self.log_path + '.failed', 'ab') as f:
+            for conversation_id, messages in batch:
+                f.write(self._encode(conversation_id, messages))
+            f.flush()
+            os.fsync(f.fileno())
+        logger.error("Moved write-behind batch items=%d to %s.failed", len(batch), self.log_path)
+
+    def _settle(self, items: int):
+        # Once every logged item has been written or dead-lettered, the log can start
+        # over. Delivery is at-least-once: an entry logged just after a truncate may
+        # belong to an item that was already written, and is skipped when replayed.
+        with self._log_lock:
+            self._pending -= items
+            if self._log is not None and self._pending == 0 and not self._log.closed:
+                self._log.truncate(0)
+
+    def _replay(self):
+        """Write what an earlier process left in the log, returning False on shutdown"""
+        with open(self.log_path, 'rb') as f:
+            lines = f.read(self._replay_bytes).splitlines()
+        pending = []
+        for line in lines:
+            try:
+                entry = json_util.loads(line)
+            except ValueError:
+                logger.warning("Skipping torn write-behind log entry")
+                continue
+            pending.append((entry["c"], entry["m"]))
+        logger.info("Replaying write-behind log items=%d", len(pending))
+        for start in range(0, len(pending), self.batch_size):
+            if not self._flush(pending[start:start + self.batch_size]):
+                return False
+        self._replay_bytes = 0
+        self._settle(0)
+        return True
+
+    @staticmethod
+    def _encode(conversation_id: str, messages: list):
+        return (json_util.dumps({"c": conversation_id, "m": messages}) + "\n").encode('utf-8')
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """Return the process-wide write-behind queue, starting it on first use"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteBehindQueue()
+            atexit.register(_write_queue.close)
+        return _write_queue
+
+
+def close_write_queue():
+    """Flush and stop the write-behind queue if this process started one"""
+    global _write_queue
+    with _write_queue_lock:
+        write_queue, _write_queue = _write_queue, None
+    if write_queue is not None:
+        write_queue.close()